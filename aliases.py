@@ -0,0 +1,90 @@
+import numpy as np, pandas as pd
+
+
+# Name resolution for the character joins.
+# The source tables spell characters differently (mentions 'Harry Potter', script 'Harry', screen times
+# 'Harry Potter (young)'), which the queries used to match with '%' || x || '%' like ... predicates,
+# a cross product scan on every run. Instead every distinct name in each source is resolved to
+# characters.Id once, stored as (source, alias, char_id) rows, and the queries equi-join on char_id.
+
+# Misspelt or partial script names -> the character they refer to
+script_aliases = {'Oiiver'             : 'Oliver wood',
+                  'Oliver'             : 'Oliver wood',
+                  'Wood'               : 'Oliver wood',
+                  'stan shunpike'      : "Stan shunpike",
+                  'Lockhart'           : 'Gilderoy lockhart',
+                  'Harry-ron-hermione' : 'All 3',
+                  'All'                : 'All 3',
+                  'Ron and harry'      : 'Harry and ron',
+                  'Tom'                : 'Tom riddle',
+                  'Vernon'             : 'Uncle vernon'
+                 }
+
+
+def normalize_names(names, extra=script_aliases):
+    """Script character names tidied and aliased as a Categorical with sorted categories
+
+    Drops newlines, halves double spaces, removes one trailing space, turns non-breaking spaces into
+    spaces and then maps names found in extra. Every rule runs once per distinct name, not per row."""
+    codes, uniq = pd.factorize(pd.Series(names), use_na_sentinel=True)
+    tidy  = (pd.Series(uniq, dtype=object).str.replace('\n', '', regex=False)
+                                          .str.replace('  ', ' ', regex=False))
+    tidy  = tidy.where(tidy.str[-1:] != ' ', tidy.str[:-1]).str.replace('\xa0', ' ', regex=False)
+    tidy  = tidy.map(extra).fillna(tidy)
+    final, cats = pd.factorize(tidy, sort=True)
+    return pd.Categorical.from_codes(np.where(codes < 0, -1, final[codes]), categories=cats)
+
+def distinct(names):
+    names = pd.Series(names).dropna().astype(str)
+    return names[names != ''].drop_duplicates().to_numpy(dtype=object)
+
+def contains(haystack, needles):
+    """(i, j) index pairs where needles[j] is a substring of haystack[i]
+
+    The haystacks are joined into one string so each needle is a single C-level find loop over
+    all of them, instead of one call per (haystack, needle) pair."""
+    hay    = '\x00'.join(haystack)
+    starts = np.cumsum([0] + [len(h) + 1 for h in haystack])
+    ii, jj = [], []
+    for j, needle in enumerate(needles):
+        k = hay.find(needle)
+        while k >= 0:
+            i = np.searchsorted(starts, k, side='right') - 1
+            ii.append(i)
+            jj.append(j)
+            k = hay.find(needle, starts[i + 1])
+    return np.array(ii, dtype=int), np.array(jj, dtype=int)
+
+def pairs(source, aliases, ids, i, j):
+    return pd.DataFrame({'source': source, 'alias': aliases[i], 'char_id': ids[j]})
+
+def alias_table(characters, mentions, script, screen, extra=script_aliases):
+    """(source, alias, char_id) rows resolving the names used in each source table to characters.Id
+
+    characters has Id and Name columns, the others are the names found in the mentions tables,
+    script_v1.character and screen_times_v1.names. The rules are the ones the old joins used:
+    mentions   the mention name contains the character's name
+    script     the character's name contains the script name, or (ignoring case) its entry in extra
+    screen     the screen time name contains one of the character's script names
+    """
+    # a missing or empty name matches nothing, as NULL did in the old joins, instead of every alias
+    characters = characters[characters['Name'].notna() & (characters['Name'].astype(str) != '')]
+    ids   = characters['Id'].to_numpy()
+    names = characters['Name'].astype(str).to_numpy(dtype=object)
+    mentions, script, screen = distinct(mentions), distinct(script), distinct(screen)
+
+    m_i, m_j = contains(mentions, names)
+    c_i, s_j = contains(names, script)
+    # only the names in extra are matched ignoring case, they are written in the script's own casing
+    keyed    = np.array([j for j, x in enumerate(script) if x in extra], dtype=int)
+    l_i, l_j = contains([n.lower() for n in names], [extra[script[j]].lower() for j in keyed])
+    l_j      = keyed[l_j]
+    script_hits = pd.DataFrame({'s': np.concatenate([s_j, l_j]), 'c': np.concatenate([c_i, l_i])}).drop_duplicates()
+    # screen name -> script names it contains -> the characters those script names resolve to
+    sc_i, sc_j  = contains(screen, script)
+    screen_hits = pd.DataFrame({'sc': sc_i, 's': sc_j}).merge(script_hits, on='s')[['sc', 'c']].drop_duplicates()
+
+    return pd.concat([pairs('mentions', mentions, ids, m_i, m_j),
+                      pairs('script',   script,   ids, script_hits['s'].to_numpy(), script_hits['c'].to_numpy()),
+                      pairs('screen',   screen,   ids, screen_hits['sc'].to_numpy(), screen_hits['c'].to_numpy())],
+                     ignore_index=True)
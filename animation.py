@@ -0,0 +1,121 @@
+import numpy as np, pandas as pd
+
+
+# Animation data for the mentions scatter.
+# px.scatter(animation_frame=...) writes every row of every frame out again, names, houses and
+# hover text included. Here each character is a fixed point of its house's trace, so the static
+# attributes are written once in the base figure, and the per-chapter values are (frame, point)
+# arrays. A frame only carries the x / y / size arrays of the traces that changed, measured
+# against both the previous frame (for play) and the first frame of its book, its key frame (for
+# slider jumps, which go through the key frame first).
+
+house_order  = ['Gryffindor', 'Hufflepuff', 'Ravenclaw', 'Slytherin', 'unknown']
+house_colors = ['red', 'gold', 'blue', 'green', 'black']
+value_cols   = ['script_counts', 'mentions', 'screen_time_sec']     # x, y, marker size
+
+
+def animation_data(X, offsets, bucket=1):
+    """(points, frames, values) for the mentions scatter
+
+    points  one row per (house, name), in trace order
+    frames  one row per frame with its label, book number and first combined chapter
+    values  (3, frames, points) float32 array of x / y / size, y NaN where a character has no row
+    X needs house, name, movie_number, chapter and the value_cols. With bucket > 1 every bucket
+    chapters of a book become one frame holding their mean."""
+    X = X[['house', 'name', 'movie_number', 'chapter'] + value_cols].copy()
+    X['house'] = X['house'].astype(str)
+    X['name']  = X['name'].astype(str)
+    start = (X['chapter'].to_numpy() - 1) // bucket * bucket + 1
+    X['frame'] = start + offsets[X['movie_number'].to_numpy() - 1]
+    X[value_cols] = X[value_cols].apply(pd.to_numeric, errors='coerce')
+    cells = X.groupby(['frame', 'house', 'name'], observed=True)[value_cols].mean()
+
+    rank   = {h: k for k, h in enumerate(house_order)}
+    points = (X[['house', 'name']].drop_duplicates()
+               .assign(order=lambda d: d['house'].map(rank).fillna(len(rank)))
+               .sort_values(['order', 'house', 'name'])
+               .drop(columns='order').reset_index(drop=True))
+    frames = (X.groupby('frame', as_index=False)
+               .agg(book=('movie_number', 'first'), chapter=('chapter', 'min')))
+    frames['label'] = frames['frame'].astype(str)
+    if bucket > 1:
+        last = frames['frame'] + X.groupby('frame')['chapter'].max().to_numpy() - frames['chapter']
+        frames['label'] += '-' + last.astype(str)
+
+    fi = pd.Index(frames['frame']).get_indexer(cells.index.get_level_values('frame'))
+    pi = pd.MultiIndex.from_frame(points).get_indexer(cells.index.droplevel('frame'))
+    values = np.full((len(value_cols), len(frames), len(points)), np.nan, dtype=np.float32)
+    values[:, fi, pi] = cells.to_numpy(dtype=np.float32).T
+    # x and size are per book values: fill the chapters a character is missing from within each book so
+    # they do not change from frame to frame, the NaN y is what hides the point
+    book = frames['book'].to_numpy()
+    for b in np.unique(book):
+        f = book == b
+        for a in (0, 2):
+            values[a, f] = pd.DataFrame(values[a, f]).ffill().bfill().to_numpy()
+    values[2] = np.nan_to_num(values[2])    # plotly rejects NaN sizes
+    return points, frames, values
+
+def changed(a, b):
+    """Whether two float arrays differ, NaN equal to NaN"""
+    return not np.array_equal(a, b, equal_nan=True)
+
+def frame_updates(values, traces, keys):
+    """Per frame, {trace: scatter update} holding only the x / y / size that changed since the previous
+    frame or the frame's key frame; key frames hold everything"""
+    out = []
+    for f in range(values.shape[1]):
+        update = {}
+        for t, idx in enumerate(traces):
+            cur = values[:, f, idx]
+            new = [f == keys[f] or changed(cur[a], values[a, f - 1, idx]) or changed(cur[a], values[a, keys[f], idx])
+                   for a in range(3)]
+            if any(new):
+                u = update[t] = {'type': 'scatter'}
+                if new[0]: u['x'] = cur[0]
+                if new[1]: u['y'] = cur[1]
+                if new[2]: u['marker'] = {'size': cur[2]}
+        out.append(update)
+    return out
+
+def animation_figure(X, offsets, bucket=1, size_max=20, data=None):
+    """Scatter of script counts against mentions sized by screen time, one frame per (bucket of) chapter
+
+    data is animation_data(X, offsets, bucket) when the caller already has it."""
+    import plotly.graph_objects as go
+    points, frames, values = animation_data(X, offsets, bucket) if data is None else data
+    houses = list(dict.fromkeys(points['house']))
+    traces = [np.flatnonzero(points['house'].to_numpy() == h) for h in houses]
+    colors = dict(zip(house_order, house_colors))
+    sizeref = 2 * np.nanmax(values[2]) / size_max ** 2 if np.isfinite(values[2]).any() else 1
+    hover = 'house=%{fullData.name}<br>script_counts=%{x}<br>mentions=%{y}<br>screen_time_sec=%{marker.size}'
+
+    data = [go.Scatter(x=values[0, 0, idx], y=values[1, 0, idx], mode='markers', name=h, legendgroup=h,
+                       hovertext=points['name'].to_numpy()[idx], hovertemplate='<b>%{hovertext}</b><br>' + hover + '<extra></extra>',
+                       marker=dict(size=values[2, 0, idx], sizemode='area', sizeref=sizeref,
+                                   color=colors.get(h, house_colors[-1])))
+            for h, idx in zip(houses, traces)]
+
+    book = frames['book'].to_numpy()
+    keys = np.searchsorted(book, book) if (np.diff(book) >= 0).all() else np.arange(len(book))
+    names = frames['label'].tolist()
+    fig_frames = []
+    for label, update in zip(names, frame_updates(values, traces, keys)):
+        fig_frames.append(go.Frame(name=label, traces=list(update), data=list(update.values())))
+
+    step = dict(mode='immediate', frame=dict(duration=0, redraw=False), transition=dict(duration=0))
+    play = dict(mode='immediate', fromcurrent=True, frame=dict(duration=500, redraw=False),
+                transition=dict(duration=500, easing='linear'))
+    sliders = [dict(active=0, currentvalue=dict(prefix='comb_chapters='), pad=dict(b=10, t=60), len=0.9, x=0.1,
+                    steps=[dict(label=label, method='animate',
+                                args=[[names[keys[f]], label] if keys[f] != f else [label], step])
+                           for f, label in enumerate(names)])]
+    buttons = [dict(label='&#9654;', method='animate', args=[None, play]),
+               dict(label='&#9724;', method='animate', args=[[None], step])]
+    fig = go.Figure(data=data, frames=fig_frames,
+                    layout=dict(sliders=sliders, legend_title_text='house',
+                                updatemenus=[dict(type='buttons', direction='left', buttons=buttons, showactive=False,
+                                                  pad=dict(r=10, t=70), x=0.1, xanchor='right', y=0, yanchor='top')]))
+    fig.update_layout(xaxis=dict(title='script_counts', range=[-10, 400]),
+                      yaxis=dict(title='mentions', range=[-10, 100]))
+    return fig
@@ -0,0 +1,287 @@
+import os, re, time, uuid, pathlib, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+from instrument import stage
+
+
+# Query backends behind datas.run_query, get_cols, load_table and head.
+# BigQueryBackend talks to the harry dataset, LocalBackend runs the same sql with DuckDB against
+# Parquet snapshots on local disk (one <table>.parquet per table) so the pipeline runs offline.
+#
+# A backend provides
+#   query(sql)            -> pandas dataframe of results, or True for statements without results
+#   query_batches(sql, n) -> iterator of dataframes of at most about n rows, fetched as they are read
+#   columns(tbl)          -> list of column names
+#   table_modified(tbl)   -> anything that changes when tbl changes, used in the cache key
+#   exists(tbl)           -> whether tbl is there
+#   load_dataframe(tbl, df), load_query(tbl, sql), load_file(tbl, path), drop(tbl)
+#   load_parquet(tbl, paths) -> load Parquet files staged by datas.load_frames
+# Every read may be called from several threads at once (see datas.gather and datas.prefetch).
+# Loads replace tbl in one step, readers see the old table or the new one and never a missing or half
+# loaded one; append=True adds the rows to tbl instead, also in one step.
+
+
+class BigQueryBackend:
+    """BigQuery through google.auth default credentials
+
+    Neither google.cloud.bigquery nor the client are loaded until the first call that needs them.
+    Results are downloaded through the BigQuery Storage Read API into Arrow when
+    google-cloud-bigquery-storage is installed, and through the REST API otherwise."""
+
+    def __init__(self, client=None):
+        self._client      = client
+        self._credentials = None
+        self._bqstorage   = None
+        # gather and prefetch threads may ask for a client first, only one of them builds it
+        self._lock        = threading.RLock()
+
+    def __reduce__(self):
+        # clients do not pickle, a worker process builds its own on first use
+        return BigQueryBackend, ()
+
+    @property
+    def bigquery(self):
+        from google.cloud import bigquery
+        return bigquery
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import google.auth
+                    cred, proj = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+                    self._credentials = cred
+                    self._client = self.bigquery.Client(credentials=cred, project=proj)
+        return self._client
+
+    @property
+    def bqstorage(self):
+        """BigQueryReadClient on the same credentials, None without google-cloud-bigquery-storage"""
+        if self._bqstorage is None:
+            try:
+                from google.cloud.bigquery_storage import BigQueryReadClient
+            except ImportError:
+                return None
+            with self._lock:
+                if self._bqstorage is None:
+                    self.client   # builds the client, and with it _credentials, if it is not there yet
+                    self._bqstorage = BigQueryReadClient(credentials=self._credentials)
+        return self._bqstorage
+
+    def query(self, sql):
+        with stage('wait for job'):
+            res = self.client.query(sql).result()
+        try:
+            with stage('to_dataframe', rows_in=res.total_rows) as st:
+                df = res.to_dataframe(bqstorage_client=self.bqstorage)
+                st.rows_out = len(df)
+            return df
+        except:
+            return True
+
+    def query_batches(self, sql, rows):
+        # with the storage API pages are the read stream's record batches, rows is only a hint
+        res = self.client.query(sql).result(page_size=rows)
+        for batch in res.to_arrow_iterable(bqstorage_client=self.bqstorage):
+            yield batch.to_pandas()
+
+    def columns(self, tbl):
+        return [s.name for s in self.client.get_table(tbl).schema]
+
+    def table_modified(self, tbl):
+        return self.client.get_table(tbl).modified
+
+    def exists(self, tbl):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.client.get_table(tbl)
+            return True
+        except NotFound:
+            return False
+
+    def bytes_scanned(self, sql):
+        """Bytes BigQuery would process for sql, from a dry run"""
+        cfg = self.bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        return self.client.query(sql, job_config=cfg).total_bytes_processed
+
+    def disposition(self, append):
+        # a job writing with WRITE_TRUNCATE replaces the table atomically when it succeeds
+        return self.bigquery.WriteDisposition.WRITE_APPEND if append else self.bigquery.WriteDisposition.WRITE_TRUNCATE
+
+    def load_dataframe(self, tbl, df, append=False):
+        cfg = self.bigquery.LoadJobConfig(write_disposition=self.disposition(append))
+        self.client.load_table_from_dataframe(df, tbl, job_config=cfg).result()
+
+    def load_query(self, tbl, sql, append=False):
+        cfg = self.bigquery.QueryJobConfig(destination=tbl, write_disposition=self.disposition(append))
+        self.client.query(sql, job_config=cfg).result()
+
+    def load_file(self, tbl, path, append=False):
+        cfg = self.bigquery.LoadJobConfig(autodetect=True, write_disposition=self.disposition(append))
+        with open(path, mode='rb') as f:
+            self.client.load_table_from_file(f, tbl, job_config=cfg).result()
+
+    def load_parquet(self, tbl, paths, append=False, workers=8):
+        """Upload the files into a staging table, load jobs running in parallel, then copy it over tbl"""
+        staging = f'{tbl.strip("`")}__staging_{uuid.uuid4().hex[:12]}'
+        cfg = self.bigquery.LoadJobConfig(source_format=self.bigquery.SourceFormat.PARQUET,
+                                          write_disposition=self.bigquery.WriteDisposition.WRITE_APPEND)
+        def upload(path):
+            with stage('upload parquet'), open(path, mode='rb') as f:
+                self.client.load_table_from_file(f, staging, job_config=cfg).result()
+        try:
+            # the first job creates the staging table, the rest append to it side by side
+            upload(paths[0])
+            with ThreadPoolExecutor(workers) as pool:
+                list(pool.map(upload, paths[1:]))
+            with stage('copy staging table'):
+                copy = self.bigquery.CopyJobConfig(write_disposition=self.disposition(append))
+                self.client.copy_table(staging, tbl.strip('`'), job_config=copy).result()
+        finally:
+            self.client.delete_table(staging, not_found_ok=True)
+
+    def drop(self, tbl):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.query(f'drop table {tbl}')
+        except NotFound:
+            pass
+
+
+# `project.dataset.table` or project.dataset.table, the table name is all a snapshot directory keeps
+table_ref = re.compile(r'`?[\w-]+\.\w+\.(\w+)`?')
+
+class LocalBackend:
+    """DuckDB over a directory of Parquet table snapshots"""
+
+    def __init__(self, path):
+        import duckdb
+        self.path = pathlib.Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.con  = duckdb.connect()
+        self.refresh()
+
+    def __reduce__(self):
+        # a worker process opens its own connection on the same snapshots
+        return LocalBackend, (self.path,)
+
+    def file(self, tbl):
+        return self.path / f'{tbl.strip("`").split(".")[-1]}.parquet'
+
+    def refresh(self):
+        """(Re)create one view per snapshot file"""
+        for f in self.path.glob('*.parquet'):
+            self.con.execute(f"create or replace view \"{f.stem}\" as select * from read_parquet('{f}')")
+
+    def translate(self, sql):
+        """Point fully qualified BigQuery table names at the local views"""
+        return table_ref.sub(lambda m: f'"{m.group(1)}"' if self.file(m.group(1)).exists() else m.group(0), sql)
+
+    # reads each use their own cursor, a DuckDB connection must not be shared between threads
+
+    def query(self, sql):
+        res = self.con.cursor().execute(self.translate(sql))
+        if res.description is None:
+            return True
+        return res.df()
+
+    def query_batches(self, sql, rows):
+        reader = self.con.cursor().execute(self.translate(sql)).fetch_record_batch(rows)
+        for batch in reader:
+            yield batch.to_pandas()
+
+    def columns(self, tbl):
+        return [r[0] for r in self.con.cursor().execute(f'describe "{self.file(tbl).stem}"').fetchall()]
+
+    def table_modified(self, tbl):
+        return os.stat(self.file(tbl)).st_mtime_ns
+
+    def exists(self, tbl):
+        return self.file(tbl).exists()
+
+    def write(self, tbl, sql, append=False):
+        """Write the result of sql next to tbl's file and rename it over that, with tbl's rows first when appending"""
+        f = self.file(tbl)
+        if append and f.exists():
+            sql = f"select * from read_parquet('{f}') union all by name select * from ({sql})"
+        tmp = f.with_name(f'{f.stem}.{uuid.uuid4().hex[:12]}.tmp')
+        try:
+            self.con.cursor().execute(f"copy ({sql}) to '{tmp}' (format parquet)")
+            os.replace(tmp, f)
+        finally:
+            tmp.unlink(missing_ok=True)
+        self.refresh()
+
+    def load_dataframe(self, tbl, df, append=False):
+        with tempfile.TemporaryDirectory() as d:
+            df.to_parquet(f'{d}/part.parquet', index=False)
+            self.load_parquet(tbl, [f'{d}/part.parquet'], append)
+
+    def load_query(self, tbl, sql, append=False):
+        self.write(tbl, self.translate(sql), append)
+
+    def load_file(self, tbl, path, append=False):
+        self.write(tbl, f"select * from read_csv_auto('{path}')", append)
+
+    def load_parquet(self, tbl, paths, append=False):
+        self.write(tbl, f'select * from read_parquet({[str(p) for p in paths]!r})', append)
+
+    def drop(self, tbl):
+        self.con.execute(f'drop view if exists "{self.file(tbl).stem}"')
+        self.file(tbl).unlink(missing_ok=True)
+
+
+class LatencyBackend:
+    """Another backend with a round trip of latency seconds added to every read and page_latency to
+    every page, to measure how much of a run is spent waiting on BigQuery without using it"""
+
+    def __init__(self, backend, latency=0.2, page_latency=0.05):
+        self.backend      = backend
+        self.latency      = latency
+        self.page_latency = page_latency
+
+    def __getattr__(self, name):
+        # loads, drop and anything else go straight through; backend itself and dunders are never
+        # delegated, or an instance without backend set yet (unpickling, copy) recurses forever
+        if name == 'backend' or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.backend, name)
+
+    def __reduce__(self):
+        return LatencyBackend, (self.backend, self.latency, self.page_latency)
+
+    def query(self, sql):
+        time.sleep(self.latency)
+        return self.backend.query(sql)
+
+    def query_batches(self, sql, rows):
+        time.sleep(self.latency)
+        for page in self.backend.query_batches(sql, rows):
+            time.sleep(self.page_latency)
+            yield page
+
+    def columns(self, tbl):
+        time.sleep(self.latency)
+        return self.backend.columns(tbl)
+
+    def table_modified(self, tbl):
+        time.sleep(self.latency)
+        return self.backend.table_modified(tbl)
+
+    def exists(self, tbl):
+        time.sleep(self.latency)
+        return self.backend.exists(tbl)
+
+
+def default_backend():
+    """LocalBackend on HARRY_LOCAL_DIR when it is set, BigQuery otherwise"""
+    path = os.environ.get('HARRY_LOCAL_DIR')
+    return LocalBackend(path) if path else BigQueryBackend()
+
+def snapshot(tables, path, source=None):
+    """Copy tables from source (BigQuery by default) into Parquet files under path for LocalBackend"""
+    source = source or BigQueryBackend()
+    local  = LocalBackend(path)
+    for tbl in tables:
+        local.load_dataframe(tbl, source.query(f'select * from `{tbl}`'))
+    return local
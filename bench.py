@@ -0,0 +1,510 @@
+import os, sys, json, time, tempfile, pathlib, statistics, subprocess, numpy as np, pandas as pd
+from cleaning import character_pipeline
+from cache import QueryCache
+from tests.synthetic import (make_join, make_tables, local_backend, make_sentences, make_paragraphs, make_corpus,
+                             make_scores, make_script, make_mentions_frame, make_scored)
+from tests.legacy import (legacy_character_query, legacy_clean, legacy_split_into_sentences, legacy_sentiment_figure,
+                          legacy_clean_movie_characters, legacy_comb_chapters, legacy_mentions_figure, legacy_load,
+                          dense_design, dense_cv)
+
+
+# Benchmarks for the data pipeline, run offline against synthetic frames from tests/synthetic.py, the
+# old code they replace in tests/legacy.py. The parity checks are the tests, python -m pytest -q.
+# python bench.py                      the one-off before / after benchmarks
+# python bench.py suite [scale]        the benchmark suite, results saved under .benchmarks/<scale>/
+# python bench.py compare [old new]    two saved suite results, by default the latest two of a scale
+
+
+def timed(f, *args, **kwargs):
+    t = time.perf_counter()
+    out = f(*args, **kwargs)
+    return out, time.perf_counter() - t
+
+
+def bench_clean(sizes=(10_000, 100_000, 1_000_000), legacy_max=10_000):
+    """rows/sec of the cleaning step, the legacy loop only runs up to legacy_max rows"""
+    for n in sizes:
+        df = make_join(n)
+        _, t = timed(character_pipeline, df)
+        line = f'clean {n:>9,} rows  vectorized {n/t:>12,.0f} rows/s'
+        if n <= legacy_max:
+            _, tl = timed(legacy_clean, df)
+            line += f'  legacy {n/tl:>10,.0f} rows/s  speedup {tl/t:,.0f}x'
+        print(line)
+    character_pipeline.report()
+
+def bench_cache(n=100_000, latency=1.0):
+    """Miss, hit, invalidation and eviction of the result cache against a local stand-in backend"""
+    frame    = make_join(n)
+    modified = {'p.harry.characters': 1, 'p.harry.mentions': 1}
+    def run(query):
+        time.sleep(latency)       # network round trip and to_dataframe
+        return frame
+    q = 'select * from `p.harry.characters` join p.harry.mentions using (name)'
+    with tempfile.TemporaryDirectory() as d:
+        cache = QueryCache(d)
+        _, miss = timed(cache.fetch, q, run, modified.get)
+        _, hit  = timed(cache.fetch, '  select *\n from `p.harry.characters`  join p.harry.mentions using (name);', run, modified.get)
+        modified['p.harry.mentions'] = 2
+        _, stale = timed(cache.fetch, q, run, modified.get)
+        print(f'cache {n:,} rows  miss {miss:.2f}s  hit {hit:.3f}s  after table change {stale:.2f}s  '
+              f'hits={cache.hits} misses={cache.misses}  {cache.size()/1e6:.1f} MB on disk')
+        cache.max_bytes = cache.size() // 2
+        cache.evict()
+        print(f'cache after halving the cap: {len(list(cache.path.glob("*.parquet")))} entry left')
+
+def bench_alias_join(scales=(100, 400, 1600), backend=None):
+    """Wall time (and BigQuery bytes scanned) of the LIKE joins against the name_alias equi-joins
+
+    Runs on synthetic local tables at each character count in scales, or once on backend when given."""
+    import datas
+    runs = [(None, backend)] if backend else [(n, None) for n in scales]
+    for n, b in runs:
+        with tempfile.TemporaryDirectory() as d:
+            datas.set_backend(b or local_backend(make_tables(chars=n), d))
+            _, t_alias = timed(datas.build_name_alias)
+            old, t_old = timed(datas.run_query, legacy_character_query, use_cache=False)
+            new, t_new = timed(datas.run_query, datas.character_query(), use_cache=False)
+            line = (f'join {n or "backend":>7} characters  like {t_old:.2f}s ({len(old)} rows)  '
+                    f'alias {t_new:.2f}s ({len(new)} rows) + {t_alias:.2f}s alias build')
+            if hasattr(datas.backend, 'bytes_scanned'):
+                line += (f'  bytes like {datas.backend.bytes_scanned(legacy_character_query):,}'
+                         f'  alias {datas.backend.bytes_scanned(datas.character_query()):,}')
+            print(line)
+
+def bench_score(n=50_000, workers=None):
+    """sentences/sec of the two-TextBlob loop against scoring.score from 1 to every core"""
+    from textblob import TextBlob
+    from scoring import score
+    sents = make_sentences(n)
+    k = min(n, 5000)
+    _, t = timed(lambda: [[TextBlob(s).polarity, TextBlob(s).subjectivity] for s in sents[:k]])
+    print(f'score {k:,} sentences  two TextBlobs {k/t:>10,.0f} sentences/s')
+    for w in workers or sorted({1, 2, 4, os.cpu_count() or 1}):
+        _, t = timed(score, sents, workers=w)
+        print(f'score {n:,} sentences  {w:>2} workers {n/t:>10,.0f} sentences/s')
+
+def bench_split(n=20_000):
+    """MB/s of the old splitter against the precompiled one, as strings and as offsets"""
+    from splitter import split_into_sentences, sentence_spans
+    paras = make_paragraphs(n)
+    mb    = sum(len(p.encode()) for p in paras) / 1e6
+    for name, f in [('old regex passes', legacy_split_into_sentences),
+                    ('splitter strings', split_into_sentences),
+                    ('splitter spans',   lambda p: list(sentence_spans(p)))]:
+        _, t = timed(lambda: [f(p) for p in paras])
+        print(f'split {mb:.1f} MB  {name:<17} {mb/t:>6.1f} MB/s')
+
+def stream_peak(rows, workers=1):
+    """Run sentiment_frame on the current backend and print sentences, seconds and peak RSS growth"""
+    import resource, sentiment
+    from scoring import score_batch
+    score_batch(['warm up the analyzer'])
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    hdf, t = timed(sentiment.sentiment_frame, workers=workers, rows=rows)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(len(hdf), t, (peak - base) / 1024)
+
+def bench_stream(paragraphs=1500, pages=(250, 1_000_000)):
+    """Peak RSS growth and wall time of sentiment_frame reading results in pages of each size
+
+    Each size runs in a fresh process on local tables. The largest page reads everything at once,
+    as the old make_sentiment_plt did."""
+    with tempfile.TemporaryDirectory() as d:
+        local_backend(make_corpus(paragraphs, paragraphs), d)
+        env = dict(os.environ, HARRY_LOCAL_DIR=d, HARRY_CACHE_MAX_BYTES='0')
+        for rows in pages:
+            out = subprocess.run([sys.executable, '-W', 'ignore', '-c', f'import bench; bench.stream_peak({rows})'],
+                                 env=env, capture_output=True, text=True, check=True).stdout.split()
+            n, t, mb = int(out[-3]), float(out[-2]), float(out[-1])
+            print(f'stream pages of {rows:>9,} rows  {n:,} sentences  {t:.1f}s  peak RSS +{mb:.0f} MB')
+
+def bench_store(paragraphs=1500, added=50):
+    """sentiment_frame rescoring everything vs a SentimentStore, first run, unchanged rerun and rerun
+    after rows are appended to one movie table"""
+    import datas, sentiment
+    from store import SentimentStore
+    with tempfile.TemporaryDirectory() as d:
+        tables = make_corpus(paragraphs, paragraphs)
+        datas.set_backend(local_backend(tables, d))
+        store = SentimentStore(f'{d}/sentiment.sqlite')
+        full, t = timed(sentiment.sentiment_frame, workers=1)
+        print(f'store  no store              {len(full):>8,} sentences  {t:6.2f}s')
+        for name in ['first run', 'unchanged rerun']:
+            hdf, t = timed(sentiment.sentiment_frame, workers=1, store=store)
+            print(f'store  {name:<22}{len(hdf):>8,} sentences  {t:6.2f}s')
+        movie = tables['movie_chamber_of_secrets']
+        extra = pd.DataFrame({'character': 'harry', 'sentence': make_sentences(added, seed=99)})
+        datas.backend.load_dataframe('movie_chamber_of_secrets', pd.concat([movie, extra], ignore_index=True))
+        hdf, t = timed(sentiment.sentiment_frame, workers=1, store=store)
+        print(f'store  {f"{added} rows appended":<22}{len(hdf):>8,} sentences  {t:6.2f}s')
+
+def bench_heatmap(sizes=(10_000, 100_000, 1_000_000)):
+    """Figure JSON size and time to build and serialise it, raw points vs precomputed bins
+
+    Serialising to JSON is what fig.show hands to the browser, which then bins the raw points
+    itself, so the JSON size is also a proxy for the time the page takes to draw."""
+    import plotly.io as pio
+    from sentiment import sentiment_figure
+    for n in sizes:
+        hdf = make_scores(n)
+        for name, f in [('raw points', legacy_sentiment_figure), ('binned', sentiment_figure)]:
+            t = time.perf_counter()
+            js = pio.to_json(f(hdf))
+            t = time.perf_counter() - t
+            print(f'heatmap {n:>9,} sentences  {name:<10} {len(js)/1e6:8.2f} MB  {t:6.2f}s')
+
+def bench_movie_characters(lines=(5_000, 30_000, 300_000), legacy_max=30_000):
+    """Row loop vs vectorized normalize_names on script tables, and a downstream groupby"""
+    from sentiment import clean_movie_characters
+    for n in lines:
+        df = make_script(n)
+        runs = [('vectorized', clean_movie_characters)] + ([('row loop', legacy_clean_movie_characters)] if n <= legacy_max else [])
+        for name, f in runs:
+            out, t = timed(f, df.copy())
+            _, g = timed(lambda: out.groupby('character', observed=True)['movie_number'].value_counts())
+            print(f'movie characters {n:>8,} lines  {name:<10} {n/t:>12,.0f} lines/s  groupby {g*1000:6.1f} ms')
+
+def bench_mentions_frame(scales=(50, 200, 800), legacy_max=200):
+    """comb_chapters as the old row loop vs the chapter offset lookup, and frame memory before / after compact"""
+    import datas
+    from cleaning import mentions_pipeline, compact
+    for n in scales:
+        with tempfile.TemporaryDirectory() as d:
+            datas.set_backend(local_backend(make_tables(chars=n), d))
+            datas.build_name_alias()
+            X = mentions_pipeline(datas.run_query(datas.character_query(datas.mentions_chap), use_cache=False))
+            new, t_new = timed(lambda: X.assign(comb_chapters=X['chapter'] + datas.chapter_offsets()[X['movie_number'].to_numpy() - 1]))
+            line = f'mentions {len(X):>8,} rows  offsets {t_new*1000:7.1f} ms'
+            if n <= legacy_max:
+                old, t_old = timed(legacy_comb_chapters, X.copy())
+                assert (old['comb_chapters'] == new['comb_chapters']).all()
+                line += f'  row loop {t_old*1000:9.1f} ms'
+            small, t_c = timed(compact, new)
+            before, after = new.memory_usage(deep=True).sum() / 1e6, small.memory_usage(deep=True).sum() / 1e6
+            print(f'{line}  memory {before:6.2f} MB -> {after:5.2f} MB ({t_c*1000:.1f} ms to compact)')
+
+def bench_animation(scales=(50, 200, 800), buckets=(1, 3)):
+    """Figure JSON size and build + serialise time of the mentions animation over all seven books"""
+    import plotly.io as pio
+    from animation import animation_figure
+    for n in scales:
+        X, offsets = make_mentions_frame(n)
+        runs = [('px rows', lambda: legacy_mentions_figure(X, offsets))]
+        runs += [(f'bucket {b}', lambda b=b: animation_figure(X, offsets, b)) for b in buckets]
+        for name, f in runs:
+            js, t = timed(lambda: pio.to_json(f()))
+            print(f'animation {n:>4} characters {len(X):>8,} rows  {name:<9} {len(js)/1e6:7.2f} MB  {t:6.2f}s')
+
+def bench_fetch(paragraphs=300, latency=0.2, page_latency=0.05, rows=500):
+    """End to end sentiment_frame wall time against local tables behind a LatencyBackend, with the
+    schema / modified time lookups and the two queries run one after another vs concurrently"""
+    import datas, sentiment
+    from backends import LatencyBackend
+    with tempfile.TemporaryDirectory() as d:
+        from scoring import score_batch
+        score_batch(['warm up the analyzer'])
+        local = datas.set_backend(local_backend(make_corpus(paragraphs, paragraphs), d))
+        datas.set_cache(QueryCache(f'{d}/cache'))
+        _, t = timed(sentiment.sentiment_frame, workers=1, rows=rows)
+        print(f'fetch  no latency                      {t:6.2f}s')
+        datas.set_backend(LatencyBackend(local, latency, page_latency))
+        workers, depth = datas.fetch_workers, datas.prefetch_depth
+        for name, w, p in [('sequential', 1, 0), ('concurrent', workers, depth)]:
+            datas.fetch_workers, datas.prefetch_depth = w, p
+            hdf, t = timed(sentiment.sentiment_frame, workers=1, rows=rows)
+            print(f'fetch  {latency}s latency, {page_latency}s a page  {name:<10} {t:6.2f}s  ({len(hdf):,} sentences)')
+        datas.fetch_workers, datas.prefetch_depth = workers, depth
+
+def bench_partitions(paragraphs=1500, workers=None):
+    """Wall time of sentiment_frame streaming in one process vs one book / movie per pool task, with
+    the pool growing up to every core; the partitioned results must equal the streamed ones"""
+    import datas, sentiment
+    with tempfile.TemporaryDirectory() as d:
+        datas.set_backend(local_backend(make_corpus(paragraphs, paragraphs), d))
+        datas.set_cache(QueryCache(f'{d}/cache'))
+        ref, t = timed(sentiment.sentiment_frame, workers=1)
+        print(f'partitions  streamed, 1 process  {t:6.2f}s  ({len(ref):,} sentences)')
+        for w in workers or sorted({1, 2, 4, os.cpu_count() or 1}):
+            hdf, t = timed(sentiment.sentiment_frame, workers=w, partitioned=True)
+            pd.testing.assert_frame_equal(hdf, ref)
+            print(f'partitions  {w:>2} workers{"":<11}{t:6.2f}s')
+
+def bench_instrument(n=100_000, rows=20_000):
+    """Cost of a stage with tracing off and on, and of tracing a character_pipeline run"""
+    import instrument
+    for name, on in [('off', False), ('on', True)]:
+        if on:
+            instrument.enable()
+        _, t = timed(lambda: [instrument.stage('x').__enter__().__exit__() for _ in range(n)])
+        df = make_join(rows)
+        _, t_clean = timed(character_pipeline, df)
+        instrument.disable()
+        print(f'instrument {name:<3}  {t/n*1e6:6.2f} us a stage  character_pipeline {rows:,} rows {t_clean*1000:7.1f} ms')
+
+def bench_model(sizes=(10_000, 100_000, 1_000_000), alphas=20, k=5, dense_max=100_000):
+    """Fit and batched predict rows/s, and a k-fold sweep over alphas against refitting the dense design
+    for every fold and alpha"""
+    import model
+    alphas = np.r_[0, np.logspace(-2, 3, alphas - 1)]
+    for n in sizes:
+        X = character_pipeline(make_join(n))
+        X = X[X[model.target].notna()]
+        r, t_fit = timed(model.Regression(1).fit, X)
+        _, t_pred = timed(r.predict, X)
+        _, t_cv = timed(model.cross_validate, X, alphas, k)
+        line = (f'model {len(X):>9,} rows  fit {len(X)/t_fit:>11,.0f} rows/s  predict {len(X)/t_pred:>11,.0f} rows/s  '
+                f'{k}-fold x {len(alphas)} alphas {t_cv:6.2f}s')
+        if n <= dense_max:
+            enc = model.Encoder().fit(X)
+            A, y = dense_design(enc, enc.transform(X)), X[model.target].to_numpy(dtype=float)
+            _, t_dense = timed(dense_cv, A, y, model.folds(len(y), k), alphas)
+            line += f'  dense refits {t_dense:6.2f}s'
+        print(line)
+
+def load_test(port, path, headers={}, seconds=2.0, clients=8):
+    """Requests/sec of clients threads each sending GET path over its own keep-alive connection"""
+    import http.client, threading
+    counts, start = [0] * clients, time.perf_counter()
+    def client(i):
+        c = http.client.HTTPConnection('127.0.0.1', port)
+        while time.perf_counter() - start < seconds:
+            c.request('GET', path, headers=headers)
+            r = c.getresponse()
+            r.read()
+            counts[i] += r.status in (200, 304)
+        c.close()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+def bench_server(chars=100, paragraphs=300, added=50, seconds=2.0, clients=(1, 8)):
+    """Build, unchanged and incremental refresh of the server's resources, then requests/sec of full,
+    gzipped and 304 responses; the load test clients share the server's process"""
+    import threading, datas, server
+    with tempfile.TemporaryDirectory() as d:
+        tables = {**make_tables(chars, 20_000), **make_corpus(paragraphs, paragraphs)}
+        datas.set_backend(local_backend(tables, d))
+        datas.set_cache(QueryCache(f'{d}/cache'))
+        datas.build_name_alias()
+        app = server.App(interval=3600, workers=1, store=f'{d}/sentiment.sqlite')
+        built, t = timed(app.refresh)
+        print(f'server build {"+".join(built):<22} {t:6.2f}s')
+        etags = {p: r.etag for p, r in app.resources.items()}
+        built, t = timed(app.refresh)
+        print(f'server unchanged refresh{"":<11}{t:6.2f}s')
+        movie = tables['movie_chamber_of_secrets']
+        extra = pd.DataFrame({'character': 'harry', 'sentence': make_sentences(added, seed=99)})
+        datas.backend.load_dataframe('movie_chamber_of_secrets', pd.concat([movie, extra], ignore_index=True))
+        built, t = timed(app.refresh)
+        assert built == ['sentiment']
+        assert all((app.resources[p].etag == e) == p.startswith('/mentions') for p, e in etags.items())
+        print(f'server {added} movie rows appended, rebuilt {"+".join(built):<9} {t:6.2f}s')
+
+        httpd = server.make_server(app, port=0)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        port = httpd.server_address[1]
+        for path in ['/sentiment/figure', '/mentions/figure', '/mentions/data']:
+            res = app.resources[path]
+            modes = [('full', {}, len(res.body)), ('gzip', {'Accept-Encoding': 'gzip'}, len(res.gzipped)),
+                     ('304', {'If-None-Match': res.etag}, 0)]
+            for c in clients:
+                line = f'server {path:<18} {c} clients'
+                for name, headers, size in modes:
+                    line += f'  {name} {load_test(port, path, headers, seconds, c):7,.0f} req/s ({size:,} B)'
+                print(line)
+        httpd.shutdown()
+        httpd.server_close()
+
+def bench_load(sizes=(1_000_000, 5_000_000), rows=1_000_000):
+    """Rows/s loading a scored sentences table into a LocalBackend: drop and one monolithic write vs
+    chunked Parquet staging with the swap, for a frame and for a generator of frames"""
+    import datas
+    from backends import LocalBackend
+    with tempfile.TemporaryDirectory() as d:
+        datas.set_backend(LocalBackend(d))
+        for n in sizes:
+            df = make_scored(n)
+            _, t_old = timed(legacy_load, datas.backend, 'db.scored', df)
+            line = f'load {n:>10,} rows  drop + write {n/t_old:>10,.0f} rows/s'
+            for w in sorted({1, datas.load_workers}):
+                _, t = timed(datas.load_frames, 'db.scored', df, rows=rows, workers=w)
+                line += f'  chunked {w} threads {n/t:>10,.0f} rows/s'
+            gen = (make_scored(rows, seed=k) for k in range(n // rows))
+            _, t = timed(datas.load_frames, 'db.scored', gen, rows=rows)
+            print(line + f'  generator {n/t:>10,.0f} rows/s (incl. making it)')
+
+def read_all(units):
+    """Every sentence of units, an iterator of lists each, only counted"""
+    return sum(len(batch) for batch in units)
+
+def bench_corpus(paragraphs=1500, rows=5000):
+    """Building the corpus, then reading every sentence of the seven books and three movies through
+    queries and the splitter vs from the memory-mapped corpus, with the Python heap peak of each;
+    and sentiment_frame both ways"""
+    import tracemalloc, datas, sentiment, corpus
+    with tempfile.TemporaryDirectory() as d:
+        datas.set_backend(local_backend(make_corpus(paragraphs, paragraphs), d))
+        datas.set_cache(QueryCache(f'{d}/cache'))
+        c, t = timed(corpus.build_corpus, corpus.Corpus(f'{d}/corpus'), rows)
+        _, t_again = timed(corpus.build_corpus, c, rows)
+        n = sum(u['sentences'] for u in c.units.values())
+        print(f'corpus build {t:6.2f}s  unchanged {t_again * 1000:5.1f}ms  {n:,} sentences  {c.sizes() / 2**20:6.1f} MB on disk')
+
+        def from_tables():
+            return read_all(ss for _, _, q, text_col, series_col, prep in sentiment.partitions()
+                            for ss, _ in sentiment.stream_sentences(datas.iter_query(q, rows), text_col, series_col, prep))
+        def from_corpus():
+            return read_all(b for u in c.units for b in c.sentences(u).batches())
+        for name, fn in [('tables + split', from_tables), ('mapped corpus', from_corpus)]:
+            count, t = timed(fn)
+            tracemalloc.start()
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'corpus read {name:<15} {count:,} sentences  {count / t:>10,.0f} sentences/s  peak heap {peak / 2**20:6.1f} MB')
+        everything = [s for u in c.units for b in c.sentences(u).batches() for s in b]
+        print(f'corpus all sentences as str objects {sum(map(sys.getsizeof, everything)) / 2**20:6.1f} MB')
+        for name, kw in [('streamed', {}), ('corpus', {'corpus': c})]:
+            _, t = timed(sentiment.sentiment_frame, workers=1, rows=rows, **kw)
+            print(f'corpus sentiment_frame {name:<9} {t:6.2f}s')
+
+# Benchmark suite: the same synthetic tables at each scale, every benchmark run once to warm up and
+# then timed repeat times, and the results saved with the commit they ran on.
+
+scales = {'small' : dict(chars=100,  script_lines=20_000,  paragraphs=300,  lines=300,  sentences=5_000),
+          'medium': dict(chars=400,  script_lines=100_000, paragraphs=1500, lines=1500, sentences=100_000),
+          'large' : dict(chars=1600, script_lines=400_000, paragraphs=6000, lines=6000, sentences=400_000)}
+
+suite = {}
+
+def benchmark(fn):
+    """Add fn(scale params) -> (run, units, unit) to the suite; run() is what gets timed"""
+    suite[fn.__name__[len('suite_'):]] = fn
+    return fn
+
+@benchmark
+def suite_clean_df(p):
+    import datas
+    datas.build_name_alias()
+    return datas.clean_df, p['chars'], 'characters'
+
+@benchmark
+def suite_mentions_prep(p):
+    import datas
+    from animation import animation_data
+    datas.build_name_alias()
+    return lambda: animation_data(*datas.mentions_data()), p['chars'], 'characters'
+
+@benchmark
+def suite_split(p):
+    from splitter import split_into_sentences
+    paras = make_paragraphs(p['paragraphs'] * 10)
+    return lambda: [split_into_sentences(x) for x in paras], len(paras), 'paragraphs'
+
+@benchmark
+def suite_score(p):
+    from scoring import score
+    sents = make_sentences(p['sentences'])
+    return lambda: score(sents, workers=1), len(sents), 'sentences'
+
+@benchmark
+def suite_sentiment_frame(p):
+    import sentiment
+    return lambda: sentiment.sentiment_frame(workers=1), 7 * p['paragraphs'] + 3 * p['lines'], 'rows'
+
+@benchmark
+def suite_model_cv(p):
+    import model
+    X = character_pipeline(make_join(p['chars'] * 1000))
+    return lambda: model.cross_validate(X, np.r_[0, np.logspace(-2, 3, 19)]), len(X), 'rows'
+
+def git_commit():
+    """(commit hash, whether the tree has uncommitted changes), ('unknown', True) outside git"""
+    try:
+        head  = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip() != ''
+        return head, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', True
+
+def run_suite(scale='small', repeat=3, names=None, out='.benchmarks'):
+    """Run the suite (or the benchmarks in names) on synthetic tables of scale and save the results"""
+    import datas
+    p = scales[scale]
+    results = {}
+    with tempfile.TemporaryDirectory() as d:
+        tables = {**make_tables(p['chars'], p['script_lines']), **make_corpus(p['paragraphs'], p['lines'])}
+        datas.set_backend(local_backend(tables, d))
+        off = datas.set_cache(QueryCache(f'{d}/cache'))
+        off.enabled = False
+        for name, setup in suite.items():
+            if names and name not in names:
+                continue
+            run, units, unit = setup(p)
+            run()
+            times = [timed(run)[1] for _ in range(repeat)]
+            results[name] = {'best_s': min(times), 'median_s': statistics.median(times), 'times_s': times,
+                             'units': units, 'unit': unit, 'per_s': units / min(times)}
+            print(f'suite {scale:<6} {name:<18} {min(times):8.3f}s best  {statistics.median(times):8.3f}s median  '
+                  f'{units / min(times):>12,.0f} {unit}/s')
+
+    commit, dirty = git_commit()
+    record = {'commit': commit, 'dirty': dirty, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': sys.version.split()[0], 'platform': sys.platform, 'cpus': os.cpu_count(),
+              'scale': scale, 'params': p, 'repeat': repeat, 'results': results}
+    path = pathlib.Path(out) / scale / f'{record["date"].replace(":", "")}_{commit[:10]}{"_dirty" if dirty else ""}.json'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(record, indent=1))
+    print(f'saved {path}')
+    return path
+
+def compare_results(old=None, new=None, scale='small', threshold=0.1, out='.benchmarks'):
+    """Best times of two saved suite runs (the latest two of scale by default); 1 if any benchmark got
+    more than threshold slower, else 0"""
+    if old is None:
+        old, new = sorted((pathlib.Path(out) / scale).glob('*.json'))[-2:]
+    a, b = [json.loads(pathlib.Path(f).read_text()) for f in (old, new)]
+    print(f'{a["commit"][:10]} ({a["date"]}) -> {b["commit"][:10]} ({b["date"]})')
+    slower = 0
+    for name in sorted(set(a['results']) | set(b['results'])):
+        ra, rb = a['results'].get(name), b['results'].get(name)
+        if ra is None or rb is None:
+            print(f'  {name:<18} only in {"new" if ra is None else "old"}')
+            continue
+        ratio = rb['best_s'] / ra['best_s']
+        flag  = '  slower' if ratio > 1 + threshold else '  faster' if ratio < 1 - threshold else ''
+        slower += ratio > 1 + threshold
+        print(f'  {name:<18} {ra["best_s"]:8.3f}s -> {rb["best_s"]:8.3f}s  x{ratio:5.2f}{flag}')
+    return int(slower > 0)
+
+if __name__ == '__main__':
+    import warnings
+    warnings.simplefilter('ignore')
+    if sys.argv[1:2] == ['suite']:
+        run_suite(*sys.argv[2:3])
+        sys.exit()
+    if sys.argv[1:2] == ['compare']:
+        sys.exit(compare_results(*sys.argv[2:4]))
+    bench_clean()
+    bench_cache()
+    bench_alias_join()
+    bench_score()
+    bench_split()
+    bench_stream()
+    bench_store()
+    bench_heatmap()
+    bench_movie_characters()
+    bench_mentions_frame()
+    bench_animation()
+    bench_fetch()
+    bench_partitions()
+    bench_instrument()
+    bench_model()
+    bench_server()
+    bench_load()
+    bench_corpus()
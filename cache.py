@@ -0,0 +1,137 @@
+import os, re, hashlib, pathlib, threading, importlib.util
+
+
+# Local cache of query results as Parquet files.
+# A result is keyed on the normalized sql text plus the last modified time of every table it reads,
+# so editing a source table or the query misses the cache and anything else is read from disk.
+# Least recently used files are evicted once the directory grows past max_bytes.
+
+# string literals and quoted identifiers are kept as is, other runs of whitespace and comments collapse
+sql_tokens = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|(?:--[^\n]*|\s+)+""")
+sql_tables = re.compile(r'(?:from|join)\s+`?([\w-]+\.\w+\.\w+)`?', re.IGNORECASE)
+
+
+def normalize_sql(query):
+    """Collapse whitespace and comments outside quotes so formatting changes hit the same entry"""
+    return sql_tokens.sub(lambda m: m.group(1) or ' ', query).strip().rstrip(';').strip()
+
+def source_tables(query):
+    """Fully qualified project.dataset.table names read by query"""
+    return sorted(set(sql_tables.findall(query)))
+
+
+class QueryCache:
+    """Parquet result cache keyed on sql and source table modified times, with an LRU size cap"""
+
+    def __init__(self, path='~/.cache/harry/queries', max_bytes=2 * 1024**3):
+        self.path      = pathlib.Path(path).expanduser()
+        self.max_bytes = max_bytes
+        # parquet needs pyarrow, without it every lookup just misses
+        self.enabled   = importlib.util.find_spec('pyarrow') is not None
+        self.hits = self.misses = 0
+
+    def cacheable(self, query):
+        return self.enabled and normalize_sql(query).lower().startswith(('select', 'with', '(select'))
+
+    def key(self, query, table_modified, map=map):
+        """sha256 of the normalized sql and the modified time of every table it reads
+
+        map runs the table_modified lookups, pass a concurrent one to overlap their round trips."""
+        h = hashlib.sha256(normalize_sql(query).encode())
+        tables = source_tables(query)
+        for tbl, modified in zip(tables, map(table_modified, tables)):
+            h.update(f'|{tbl}@{modified}'.encode())
+        return h.hexdigest()
+
+    def file(self, key):
+        return self.path / f'{key}.parquet'
+
+    def touch(self, f):
+        """Mark f as recently used; another process may have evicted it since it was opened"""
+        try:
+            os.utime(f)
+        except (FileNotFoundError, OSError):
+            pass
+
+    def get(self, key):
+        import pandas as pd
+        f = self.file(key)
+        try:
+            df = pd.read_parquet(f)
+        except (FileNotFoundError, OSError):
+            return None
+        self.touch(f)
+        return df
+
+    def has(self, key):
+        return self.file(key).exists()
+
+    def iter_batches(self, key, rows):
+        """Pages of rows rows of a cached result, None when it is not cached
+
+        The file is opened before returning, so an entry evicted after that is still read whole."""
+        import pyarrow.parquet as pq
+        f = self.file(key)
+        try:
+            pf = pq.ParquetFile(f)
+        except (FileNotFoundError, OSError):
+            return None
+        self.touch(f)
+        return (batch.to_pandas() for batch in pf.iter_batches(batch_size=rows))
+
+    def put(self, key, df):
+        self.path.mkdir(parents=True, exist_ok=True)
+        f   = self.file(key)
+        tmp = f.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, f)
+        self.evict()
+
+    def entries(self):
+        """(mtime, size, file) of every entry, leaving out files another process deletes while listing"""
+        out = []
+        for f in self.path.glob('*.parquet'):
+            try:
+                st = f.stat()
+            except FileNotFoundError:
+                continue
+            out.append((st.st_mtime, st.st_size, f))
+        return out
+
+    def evict(self):
+        """Delete least recently used entries until the cache is under max_bytes"""
+        files = self.entries()
+        total = sum(size for _, size, _ in files)
+        for _, size, f in sorted(files):
+            if total <= self.max_bytes:
+                break
+            f.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        for f in self.path.glob('*.parquet'):
+            f.unlink(missing_ok=True)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def fetch(self, query, run, table_modified, map=map):
+        """Return the cached result of query, calling run(query) and storing its frame on a miss"""
+        if not self.cacheable(query):
+            return run(query)
+        key = self.key(query, table_modified, map)
+        df  = self.get(key)
+        if df is not None:
+            self.hits += 1
+            return df
+        self.misses += 1
+        df = run(query)
+        if hasattr(df, 'to_parquet'):
+            self.put(key, df)
+        return df
+
+
+def default_cache():
+    """Cache configured from HARRY_CACHE_DIR and HARRY_CACHE_MAX_BYTES (0 keeps nothing)"""
+    return QueryCache(os.environ.get('HARRY_CACHE_DIR', '~/.cache/harry/queries'),
+                      int(os.environ.get('HARRY_CACHE_MAX_BYTES', 2 * 1024**3)))
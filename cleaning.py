@@ -0,0 +1,199 @@
+import time, numpy as np, pandas as pd
+from collections import namedtuple
+from instrument import stage
+
+
+# Column-wise cleaning of the characters / mentions / screen time join, shared by datas.clean_df
+# and datas.mentions_animation. Every step works on whole columns through the .str accessor,
+# np.select and regex extraction so cost grows with the number of columns, not the number of cells.
+
+drop_cols = ["Id",'Wand',"Loyalty", "Skills", "Patronus","book", 'book_number', 'character', 'names', 'movie',
+             'name_1','Death', 'char_id']
+
+hair_map = {'Silver| formerly auburn' : 'Grey',
+            'Blond'                   : 'Blonde',
+            'Colourless and balding'  : 'Bald',
+           }
+
+eye_map = {'Bright green' : 'Green',
+           'Bright brown' : 'Brown',
+           'Scarlet '     : 'Scarlet',
+          }
+
+odd_births = {'Vincent Crabbe'     : 1980,
+              'Minerva McGonagall' : 1889,
+              'Pomona Sprout'      : 1941,
+              'Quirinus Quirrell'  : 1967,
+              'Sir Nicholas'       : 1450,
+             }
+
+# a whole whitespace separated token made of digits, same as word.isdigit() on str.split()
+year_pat = r'(?<!\S)(\d+)(?!\S)'
+
+# compact() dtypes: repeated strings as categoricals, counts as the smallest int, measures as float32
+category_cols = ['name', 'gender', 'house', 'species', 'hair_colour', 'eye_colour', 'job_grouped', 'blood_grouped']
+int_cols      = ['chapter', 'mentions', 'movie_number', 'script_counts', 'comb_chapters', 'birth_yr']
+float_cols    = ['screen_time_sec', 'avg_mentions']
+
+
+def strip_nbsp(X):
+    """Replace non-breaking spaces with plain spaces in every string cell of X, non-strings are left alone"""
+    for c in X.columns:
+        s = X[c]
+        if not (s.dtype == object or isinstance(s.dtype, pd.StringDtype)):
+            continue
+        try:
+            r = s.str.replace('\xa0', ' ', regex=False)
+        except AttributeError:
+            # .str refuses columns with no strings at all
+            continue
+        # .str gives NaN for non-string cells, put the originals back there
+        X[c] = r.where(r.notna(), s)
+    return X
+
+def group_jobs(job):
+    """Collapse job titles into student, D.A.D.A professor and other"""
+    return np.select([job.str.contains('Dark Arts', regex=False),
+                      job.str.contains('Student', regex=False)],
+                     ['defense against the dark arts professor', 'student'],
+                     'other')
+
+def group_blood(blood):
+    """Blood statuses listing alternatives ('x or y') become magic (unknown)"""
+    return blood.mask(blood.str.contains('or', regex=False), 'magic (unknown)')
+
+def birth_years(birth):
+    """Last whole-number token after 1880 in each birth string, 0 if there is none"""
+    # birth strings repeat a lot, so parse each distinct value once and broadcast back by code
+    codes, uniq = pd.factorize(birth)
+    uniq = pd.Series(uniq)
+    yrs = uniq.str.extractall(year_pat)
+    out = np.zeros(len(uniq), dtype='int64')
+    if not yrs.empty:
+        yrs = yrs[0].astype('int64')
+        yrs = yrs[yrs > 1880].groupby(level=0).last()
+        out[yrs.index] = yrs.values
+    return pd.Series(out[codes], index=birth.index)
+
+def lower_columns(X):
+    X.columns = X.columns.str.lower()
+    return X
+
+def override_births(X):
+    """Hand fixed birth years for characters whose birth string has no usable year"""
+    return X['name'].map(odd_births).fillna(X['birth_yr']).astype('int64')
+
+def compact(X):
+    """X with category_cols as categoricals, int_cols downcast and float_cols as float32
+
+    An int column with gaps becomes float32, 'unknown' left in a numeric column by fillna becomes NaN."""
+    X = X.copy()
+    for c in X.columns.intersection(category_cols):
+        X[c] = X[c].astype('category')
+    for c in X.columns.intersection(int_cols):
+        s = pd.to_numeric(X[c], errors='coerce')
+        X[c] = s.astype('float32') if s.isna().any() else pd.to_numeric(s.astype('int64'), downcast='integer')
+    for c in X.columns.intersection(float_cols):
+        X[c] = pd.to_numeric(X[c], errors='coerce').astype('float32')
+    return X
+
+
+# Steps are declared once as (kind, name, args) and compiled into a Pipeline.
+#   frame  : fn(X) -> X, runs on its own
+#   remap  : (col, mapping), adjacent remaps fuse into one DataFrame.replace call
+#   derive : (col, fn, src), fn(X[src]) -> new column, adjacent derives fuse into one assign
+# A derive that reads a column written earlier in the same run of derives starts a new fused group.
+Step = namedtuple('Step', 'kind name args')
+
+def frame(name, fn):
+    return Step('frame', name, fn)
+
+def remap(col, mapping):
+    return Step('remap', f'remap {col}', (col, mapping))
+
+def derive(col, fn, src, name=None):
+    return Step('derive', name or f'derive {col}', (col, fn, src))
+
+
+class Pipeline:
+    """Ordered cleaning steps, compiled once into fused groups and timed per step on every run"""
+
+    def __init__(self, steps):
+        self.steps   = list(steps)
+        self.timings = {}
+        self.groups  = self.compile()
+
+    def __add__(self, steps):
+        return Pipeline(self.steps + list(steps))
+
+    def compile(self):
+        groups = []
+        for step in self.steps:
+            g = groups[-1] if groups else None
+            if g and step.kind == g[0].kind and step.kind != 'frame' and self.fusable(g, step):
+                g.append(step)
+            else:
+                groups.append([step])
+        return groups
+
+    @staticmethod
+    def fusable(group, step):
+        if step.kind == 'remap':
+            return step.args[0] not in [s.args[0] for s in group]
+        src = step.args[2] if isinstance(step.args[2], list) else [step.args[2]]
+        return not set(src) & set(s.args[0] for s in group)
+
+    def run_group(self, X, group):
+        kind = group[0].kind
+        if kind == 'frame':
+            t = time.perf_counter()
+            X = group[0].args(X)
+            self.timings[group[0].name] = time.perf_counter() - t
+        elif kind == 'remap':
+            t = time.perf_counter()
+            X = X.replace({col: mapping for col, mapping in (s.args for s in group)})
+            self.timings[' + '.join(s.name for s in group)] = time.perf_counter() - t
+        else:
+            new = {}
+            for s in group:
+                t = time.perf_counter()
+                col, fn, src = s.args
+                new[col] = fn(X[src])
+                self.timings[s.name] = time.perf_counter() - t
+            X = X.assign(**new)
+        return X
+
+    def __call__(self, df):
+        self.timings = {}
+        X = df
+        for group in self.groups:
+            with stage(' + '.join(s.name for s in group), rows_in=len(X)) as st:
+                X = self.run_group(X, group)
+                st.rows_out = len(X)
+        return X
+
+    def report(self):
+        """Print the last run's step timings, slowest first"""
+        total = sum(self.timings.values())
+        for name, t in sorted(self.timings.items(), key=lambda kv: -kv[1]):
+            print(f'{name:<40} {t*1000:>10.2f} ms  {t/total:>6.1%}')
+
+
+character_pipeline = Pipeline([
+    frame('drop unused columns', lambda X: X.drop(columns=drop_cols, errors='ignore')),
+    frame('strip nbsp', strip_nbsp),
+    frame('keep rows with screen time', lambda X: X[~X['screen_time_sec'].isna()].reset_index(drop=True)),
+    frame('lower column names', lower_columns),
+    frame('fill unknown', lambda X: X.fillna('unknown')),
+    remap('hair_colour', hair_map),
+    remap('eye_colour', eye_map),
+    derive('job_grouped', group_jobs, 'job'),
+    derive('blood_grouped', group_blood, 'blood_status'),
+    derive('birth_yr', birth_years, 'birth'),
+    derive('birth_yr', override_births, ['name', 'birth_yr'], 'odd births'),
+    frame('drop raw columns', lambda X: X.drop(columns=['job', 'blood_status', 'birth'])),
+])
+
+mentions_pipeline = character_pipeline + [
+    derive('movie_number', lambda s: s.astype('int'), 'movie_number'),
+]
@@ -0,0 +1,187 @@
+import os, json, mmap, pathlib, numpy as np, pandas as pd
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from instrument import stage, traced
+
+
+# On-disk corpus of the book and movie text, built once from the book_* / movie_* tables.
+# Each book and movie (a unit, named like book_3) is two texts, its paragraphs as the tables hold them
+# and the sentences split_into_sentences makes of them. A text is one UTF-8 blob, <unit>.<text>.txt,
+# and a NumPy array of the byte offsets where its strings start and end, <unit>.<text>.npy; the
+# sentences also get the paragraph each came from, <unit>.owner.npy. Both are memory-mapped, so a
+# string is a slice of the page cache and the corpus costs no Python objects until they are used.
+# corpus.json records the version of the table each unit was built from, and build_corpus only
+# rebuilds the units whose table changed.
+
+
+class Text:
+    """Strings stored as one memory-mapped UTF-8 blob and an offsets array"""
+
+    def __init__(self, stem):
+        self.offsets = np.load(f'{stem}.npy', mmap_mode='r')
+        with open(f'{stem}.txt', 'rb') as f:
+            # mmap refuses empty files, and an empty text has nothing to map
+            self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def view(self, i):
+        """Bytes of string i as a memoryview on the mapped blob, no copy"""
+        return memoryview(self.blob)[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i):
+        return str(self.view(i), 'utf-8')
+
+    def batches(self, n=5000):
+        """Lists of up to n strings, each list decoded from the blob in one go"""
+        blob = memoryview(self.blob)
+        for i in range(0, len(self), n):
+            j = min(i + n, len(self))
+            off = self.offsets[i:j + 1].tolist()
+            s = str(blob[off[0]:off[-1]], 'utf-8')
+            if len(s) == off[-1] - off[0]:
+                # all ascii, byte offsets are character offsets
+                yield [s[a - off[0]:b - off[0]] for a, b in zip(off, off[1:])]
+            else:
+                yield [str(blob[a:b], 'utf-8') for a, b in zip(off, off[1:])]
+
+    def close(self):
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+
+
+class TextWriter:
+    """Appends strings to a text, which appears under stem on close()"""
+
+    def __init__(self, stem):
+        self.stem    = stem
+        self.f       = open(f'{stem}.txt.tmp', 'wb')
+        self.offsets = array('q', [0])
+
+    def add(self, s):
+        b = s.encode()
+        self.f.write(b)
+        self.offsets.append(self.offsets[-1] + len(b))
+
+    def close(self):
+        self.f.close()
+        with open(f'{self.stem}.npy.tmp', 'wb') as f:
+            np.save(f, np.frombuffer(self.offsets, dtype=np.int64))
+        os.replace(f'{self.stem}.txt.tmp', f'{self.stem}.txt')
+        os.replace(f'{self.stem}.npy.tmp', f'{self.stem}.npy')
+
+
+class Corpus:
+    """Memory-mapped paragraphs and sentences of every book and movie under path"""
+
+    def __init__(self, path='~/.cache/harry/corpus'):
+        self.path = pathlib.Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        manifest  = self.path / 'corpus.json'
+        self.units = json.loads(manifest.read_text()) if manifest.exists() else {}
+
+    def save(self):
+        tmp = self.path / 'corpus.json.tmp'
+        tmp.write_text(json.dumps(self.units, indent=1))
+        os.replace(tmp, self.path / 'corpus.json')
+
+    def paragraphs(self, unit):
+        return Text(self.path / f'{unit}.paragraphs')
+
+    def sentences(self, unit):
+        return Text(self.path / f'{unit}.sentences')
+
+    def owner(self, unit):
+        """Paragraph number of every sentence of unit"""
+        return np.load(self.path / f'{unit}.owner.npy', mmap_mode='r')
+
+    def write(self, unit, pages, text_col, prep=None):
+        """Write a unit's paragraphs and sentences from pages of its table"""
+        from splitter import split_into_sentences
+        paras, sents = TextWriter(self.path / f'{unit}.paragraphs'), TextWriter(self.path / f'{unit}.sentences')
+        owner, k = array('i'), 0
+        for page in pages:
+            with stage('corpus page', rows_in=len(page)) as st:
+                if prep is not None:
+                    page = prep(page)
+                for text in page[text_col]:
+                    paras.add(text)
+                    ss = split_into_sentences(text)
+                    for s in ss:
+                        sents.add(s)
+                    owner.extend([k] * len(ss))
+                    k += 1
+                st.rows_out = len(owner)
+        with open(self.path / f'{unit}.owner.npy.tmp', 'wb') as f:
+            np.save(f, np.frombuffer(owner, dtype=np.int32))
+        os.replace(self.path / f'{unit}.owner.npy.tmp', self.path / f'{unit}.owner.npy')
+        paras.close()
+        sents.close()
+        return k, len(owner)
+
+    def sizes(self):
+        """Bytes on disk of the corpus files"""
+        return sum(f.stat().st_size for f in self.path.glob('*') if f.suffix in ('.txt', '.npy'))
+
+
+def default_corpus():
+    """Corpus at HARRY_CORPUS, ~/.cache/harry/corpus by default"""
+    return Corpus(os.environ.get('HARRY_CORPUS', '~/.cache/harry/corpus'))
+
+def unit_sources():
+    """(unit, media, series number, table, query, text column, page prep) for every book and movie"""
+    import sentiment
+    tables = {'book': sentiment.book_tables, 'movie': sentiment.movie_tables}
+    return [(f'{m}_{n}', m, n, tables[m][n - 1], q, text_col, prep)
+            for m, n, q, text_col, _, prep in sentiment.partitions()]
+
+@traced()
+def build_corpus(corpus=None, rows=5000):
+    """Bring corpus (the default one if None or True) up to date with the book and movie tables"""
+    import datas
+    corpus = default_corpus() if corpus is None or corpus is True else corpus
+    srcs = unit_sources()
+    versions = datas.gather(datas.table_modified, [s[3] for s in srcs])
+    for (unit, media, number, tbl, q, text_col, prep), version in zip(srcs, versions):
+        if corpus.units.get(unit, {}).get('version') == str(version):
+            continue
+        with stage('write unit'):
+            paragraphs, sentences = corpus.write(unit, datas.iter_query(q, rows), text_col, prep)
+        corpus.units[unit] = {'media': media, 'series_number': number, 'paragraphs': paragraphs,
+                              'sentences': sentences, 'version': str(version)}
+        corpus.save()
+    return corpus
+
+def score_unit(path, unit, batch_size=5000):
+    """(polarity, subjectivity) arrays of every sentence of one unit, read from the corpus at path"""
+    from scoring import score
+    text = Corpus(path).sentences(unit)
+    res = [score(batch, workers=1) for batch in text.batches(batch_size)]
+    text.close()
+    cat = lambda k: np.concatenate([r[k] for r in res]) if res else np.empty(0)
+    return cat(0), cat(1)
+
+def corpus_frame(corpus=None, workers=None, batch_size=5000):
+    """polarity / subjectivity of every book and movie sentence, as sentiment_frame, scored from corpus
+
+    With workers > 1 each book and movie is scored in its own pool task, the worker mapping just its
+    unit's files."""
+    from scoring import default_workers
+    corpus = default_corpus() if corpus is None or corpus is True else corpus
+    # books then movies, each in series order, as sentiment_frame has them
+    units = sorted(corpus.units, key=lambda u: (corpus.units[u]['media'] != 'book', corpus.units[u]['series_number']))
+    workers = workers or default_workers()
+    with stage('corpus_frame') as st:
+        if workers > 1:
+            with ProcessPoolExecutor(workers) as pool:
+                res = list(pool.map(score_unit, [corpus.path] * len(units), units, [batch_size] * len(units)))
+        else:
+            res = [score_unit(corpus.path, u, batch_size) for u in units]
+        sizes = [len(p) for p, _ in res]
+        st.rows_out = sum(sizes)
+    info = [corpus.units[u] for u in units]
+    return pd.DataFrame({'polarity'     : np.concatenate([p for p, _ in res]) if res else np.empty(0),
+                         'subjectivity' : np.concatenate([s for _, s in res]) if res else np.empty(0),
+                         'media'        : np.repeat(np.array([i['media'] for i in info], dtype=object), sizes),
+                         'series_number': np.repeat([i['series_number'] for i in info], sizes).astype(int)})
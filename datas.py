@@ -1,36 +1,167 @@
-import os, pathlib, google, numpy as np, pandas as pd
-from google.cloud import bigquery
-import plotly.graph_objects as go
-import plotly.express as px
+import os, queue, weakref, pathlib, tempfile, warnings, threading, numpy as np, pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from cleaning import character_pipeline, mentions_pipeline, compact
+from cache import default_cache
+from backends import default_backend
+from aliases import alias_table
+from instrument import stage, traced, frame_bytes
 
 
-# bigquery_storage is not built into Vertex AI, so we install if necessary.
-# try-except an extrememly useful python feature.  Here, we first try to import from bigquery_storage
-# If that works, program moves on.  If that fails because it's not installed, we pip install it from https://pypi.org/.
-try:
-    from google.cloud.bigquery_storage import BigQueryReadClient
-except:
-    os.system('pip install --upgrade google-cloud-bigquery-storage')
-    from google.cloud.bigquery_storage import BigQueryReadClient
+# google.cloud.bigquery, the BigQuery client and plotly are only loaded when first needed, so importing
+# datas for subquery, the cleaning steps or a local backend does not pay for them.
+# google-cloud-bigquery(-storage) must be installed beforehand, nothing is pip installed at runtime.
 
-# Create connection to BigQuery
-cred, proj = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
-bqclient   = bigquery.Client(credentials=cred, project=proj)
+# Connection to BigQuery, or to local Parquet snapshots when HARRY_LOCAL_DIR is set (see backends.py)
+backend = default_backend()
+
+def set_backend(b):
+    """Send every query and load through b from now on"""
+    global backend
+    backend = b
+    return b
 
 
 # Define useful functions to interact with BigQuery
 def get_cols(tbl):
     """Get list of columns on tbl"""
-    t = bqclient.get_table(tbl)
-    return [s.name for s in t.schema]
+    return backend.columns(tbl)
+
+def table_modified(tbl):
+    """Last modified time of tbl, part of the result cache key"""
+    return backend.table_modified(tbl)
+
+# Metadata lookups and result downloads mostly wait on the network, so independent ones run on threads.
+# HARRY_FETCH_WORKERS=1 and HARRY_PREFETCH=0 turn that off.
+fetch_workers = int(os.environ.get('HARRY_FETCH_WORKERS', 8))
+prefetch_depth = int(os.environ.get('HARRY_PREFETCH', 2))
+
+def gather(fn, items, workers=None):
+    """[fn(x) for x in items] with the calls running concurrently on up to workers threads"""
+    items   = list(items)
+    workers = min(workers or fetch_workers, len(items))
+    if workers <= 1:
+        return [fn(x) for x in items]
+    with ThreadPoolExecutor(workers) as ex:
+        return list(ex.map(fn, items))
+
+class prefetch:
+    """Iterate pages on a background thread started right away, staying up to depth pages ahead
+
+    The next page downloads while the current one is processed, and prefetching several queries
+    before reading any of them runs them at the same time. Errors are raised in the reader. close()
+    (or leaving it as a context manager, or dropping it) stops the thread and closes pages, read to
+    the end or not."""
+
+    def __init__(self, pages, depth=None):
+        depth = prefetch_depth if depth is None else depth
+        self.stop = stop = threading.Event()
+        if depth <= 0:
+            self.pages = iter(pages)
+            return
+        self.pages = None
+        self.q, self.end = q, end = queue.Queue(depth), object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        # the thread only holds the queue and the event, not self, so an unread prefetch can be collected
+        def produce():
+            try:
+                for page in pages:
+                    if not put((page, None)):
+                        return
+                put((end, None))
+            except BaseException as e:
+                put((end, e))
+            finally:
+                if hasattr(pages, 'close'):
+                    pages.close()
+
+        threading.Thread(target=produce, daemon=True).start()
+        weakref.finalize(self, stop.set)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pages is not None:
+            return next(self.pages)
+        if self.stop.is_set():
+            raise StopIteration
+        page, err = self.q.get()
+        if err is not None or page is self.end:
+            self.stop.set()
+            if err is not None:
+                raise err
+            raise StopIteration
+        return page
+
+    def close(self):
+        self.stop.set()
+        if self.pages is not None and hasattr(self.pages, 'close'):
+            self.pages.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+# Select results are cached on local disk, see cache.default_cache for the settings
+cache = default_cache()
+
+def set_cache(c):
+    """Look up and store query results in c from now on"""
+    global cache
+    cache = c
+    return c
+
+def backend_query(query):
+    with stage('backend query') as st:
+        df = backend.query(query)
+        st.rows_out, st.bytes = len(df) if hasattr(df, '__len__') else 0, lambda: frame_bytes(df)
+    return df
 
-def run_query(query):
+def run_query(query, use_cache=True):
     """Run sql query and return pandas dataframe of results, if any"""
-    res = bqclient.query(query).result()
-    try:
-        return res.to_dataframe()
-    except:
-        return True
+    with stage('run_query') as st:
+        if use_cache:
+            df = cache.fetch(query, backend_query, table_modified, gather)
+        else:
+            df = backend_query(query)
+        st.rows_out, st.bytes = len(df) if hasattr(df, '__len__') else 0, lambda: frame_bytes(df)
+    return df
+
+def timed_pages(pages, name):
+    """pages, with reading each one recorded as a name stage"""
+    pages = iter(pages)
+    while True:
+        with stage(name) as st:
+            page = next(pages, None)
+            if page is None:
+                return
+            st.rows_out, st.bytes = len(page), lambda: frame_bytes(page)
+        yield page
+
+def iter_query(query, rows=50_000):
+    """Run sql query and yield its results as pandas dataframes of about rows rows at a time
+
+    Pages are read from the result cache when the query is in it, otherwise from the backend
+    as they are fetched, so the full result is never held in memory (and not cached)."""
+    if cache.cacheable(query):
+        pages = cache.iter_batches(cache.key(query, table_modified, gather), rows)
+        if pages is not None:
+            cache.hits += 1
+            yield from timed_pages(pages, 'cached page')
+            return
+    yield from timed_pages(backend.query_batches(query, rows), 'backend page')
 
 def head(tbl, rows=10):
     """Display the top rows of tbl"""
@@ -41,25 +172,86 @@ def head(tbl, rows=10):
 
 def delete_table(tbl):
     """Delete tbl if it exists"""
-    query = f'drop table {tbl}'
-    try:
-        run_query(query)
-    except google.api_core.exceptions.NotFound:
-        pass
-
-def load_table(tbl, df=None, query=None, file=None, overwrite=True, preview_rows=0):
-    """Load data into tbl either from a pandas dataframe, sql query, or local csv file"""
+    backend.drop(tbl)
+
+# Bulk loads: frames are cut into chunks of load_chunk_rows rows, each converted to Arrow with one
+# explicit schema and written to its own Parquet file on up to load_workers threads while the next
+# chunk is produced, so a generator of frames is never held whole. The backend then loads the staged
+# files and swaps them in for tbl in one step (see backends.py), nothing is dropped first.
+load_workers    = int(os.environ.get('HARRY_LOAD_WORKERS', 4))
+load_chunk_rows = int(os.environ.get('HARRY_LOAD_CHUNK_ROWS', 1_000_000))
+
+def chunks(frames, rows):
+    """Frames of at most rows rows out of a DataFrame or an iterable of them"""
+    for df in [frames] if isinstance(frames, pd.DataFrame) else frames:
+        for i in range(0, max(len(df), 1), rows):
+            yield df.iloc[i:i + rows]
+
+def stage_parquet(frames, path, schema=None, rows=None, workers=None):
+    """Write frames as part-<k>.parquet files under path, all with schema
+
+    Without a schema a DataFrame's own is used. For an iterable of frames the schema is inferred
+    from the chunks as they come, a column that was all null so far taking the type it gets later,
+    and files already written with it as null are rewritten at the end. Returns the files and the
+    number of rows written. Chunks that do not fit schema raise."""
+    import pyarrow as pa, pyarrow.parquet as pq
+    rows, workers = rows or load_chunk_rows, workers or load_workers
+    if schema is None and isinstance(frames, pd.DataFrame):
+        schema = pa.Schema.from_pandas(frames, preserve_index=False)
+    fixed = schema is not None
+    files, schemas, pending, n = [], [], [], 0
+    with ThreadPoolExecutor(workers) as pool:
+        for k, df in enumerate(chunks(frames, rows)):
+            if k and not len(df):
+                continue
+            table = pa.Table.from_pandas(df, schema=schema if fixed else None, preserve_index=False)
+            if not fixed:
+                schema = table.schema if schema is None else pa.unify_schemas([schema, table.schema])
+                table  = table.cast(schema)
+            files.append(pathlib.Path(path) / f'part-{k:05d}.parquet')
+            schemas.append(schema)
+            pending.append(pool.submit(pq.write_table, table, files[-1]))
+            n += len(df)
+            # at most two chunks per thread in memory, the oldest write finishes before the next chunk
+            if len(pending) > 2 * workers:
+                pending.pop(0).result()
+        for p in pending:
+            p.result()
+        # columns that were still all null when a file was written
+        recast = lambda f: pq.write_table(pq.read_table(f).cast(schema), f)
+        for p in [pool.submit(recast, f) for f, s in zip(files, schemas) if not s.equals(schema)]:
+            p.result()
+    if not files:
+        if schema is None:
+            raise Exception('no frames to load and no schema to create an empty table with')
+        files.append(pathlib.Path(path) / 'part-00000.parquet')
+        pq.write_table(schema.empty_table(), files[0])
+    return files, n
+
+def load_frames(tbl, frames, schema=None, append=False, rows=None, workers=None):
+    """Load a DataFrame or an iterable of DataFrames into tbl through Parquet files staged in chunks
+
+    tbl is replaced, or added to with append=True, only once every chunk has been written; an error
+    part way leaves it as it was. schema is a pyarrow schema, inferred by default (see stage_parquet)."""
+    with tempfile.TemporaryDirectory(prefix='harry-load-') as d:
+        with stage('stage parquet') as st:
+            files, n = stage_parquet(frames, d, schema, rows, workers)
+            st.rows_out, st.bytes = n, lambda: sum(f.stat().st_size for f in files)
+        with stage('load parquet', rows_in=n):
+            backend.load_parquet(tbl, files, append)
+    return tbl
 
-    if overwrite:
-        delete_table(tbl)
+def load_table(tbl, df=None, query=None, file=None, overwrite=True, preview_rows=0, schema=None):
+    """Load data into tbl either from a pandas dataframe (or an iterable of them), sql query, or local csv file
 
+    overwrite=True replaces tbl in one step, overwrite=False appends to it. Dataframes are loaded
+    in chunks through load_frames, with schema as their pyarrow schema if given."""
     if df is not None:
-        job = bqclient.load_table_from_dataframe(df, tbl).result()
+        load_frames(tbl, df, schema, append=not overwrite)
     elif query is not None:
-        job = bqclient.query(query, job_config=bigquery.QueryJobConfig(destination=tbl)).result()
+        backend.load_query(tbl, query, append=not overwrite)
     elif file is not None:
-        with open(file, mode='rb') as f:
-            job = bqclient.load_table_from_file(f, tbl, job_config=bigquery.LoadJobConfig(autodetect=True)).result()
+        backend.load_file(tbl, file, append=not overwrite)
     else:
         raise Exception('at least one of df, query, or file must be specified')
 
@@ -67,7 +259,6 @@ def load_table(tbl, df=None, query=None, file=None, overwrite=True, preview_rows
         head(tbl, preview_rows)
     return tbl
 
-
 def subquery(query, indents=1):
     s = '\n' + indents * '    '
     return query.strip().replace('\n', s)
@@ -84,228 +275,126 @@ rng = np.random.default_rng(42)
 
 db  = 'ambient-odyssey-331623.harry'
 
-def raw_df():
-    q = """ select * from(
+alias_tbl = f'{db}.name_alias'
+
+books = (['philosophers_stone','chamber_of_secrets', 'prisoner_of_azkaban', 'goblet_of_fire', 
+          'order_of_the_phoenix','half_blood_prince', 'deathly_hallows' ])
+
+mentions_avg = """select al.char_id, m.name as name_1, m.book, avg(m.mentions) as avg_mentions 
+                    from `ambient-odyssey-331623.harry.mentions` as m
+                    join `ambient-odyssey-331623.harry.name_alias` as al on al.source = 'mentions' and al.alias = m.name
+                    group by al.char_id, m.name, m.book"""
+
+mentions_chap = """select al.char_id, m.name as name_1, m.book, m.chapter, m.mentions
+                    from `ambient-odyssey-331623.harry.mentions_chapters` as m
+                    join `ambient-odyssey-331623.harry.name_alias` as al on al.source = 'mentions' and al.alias = m.name
+                    """
+
+book_numbers = '\n        '.join(f"when book = '{b}' then {i + 1}" for i, b in enumerate(books))
+
+def character_query(mentions=mentions_avg):
+    """characters joined to mentions, script line counts and screen times on the canonical char_id"""
+    return f""" select * from(
     select * from(
         select *,
             case 
-        when book = 'philosophers_stone' then 1
-        when book = 'chamber_of_secrets' then 2
-        when book = 'prisoner_of_azkaban' then 3
+        {book_numbers}
         end as book_number
             from (
-                select *
-                from `ambient-odyssey-331623.harry.characters` as A
-                join (
-                    select name as name_1, book, avg(mentions) as avg_mentions 
-                    from `ambient-odyssey-331623.harry.mentions` 
-                    group by name, book) as B
-                on '%' || B.name_1||'%' like '%' || A.name ||'%'
-    ))as A 
-
-    full join (SELECT character, movie_number, count(*) as script_counts
-    FROM `ambient-odyssey-331623.harry.script_v1` group by character, movie_number) as B 
-    on A.name  like '%' || B.character ||'%' and A.book_number = B.movie_number
+                select *, Id as char_id
+                from `ambient-odyssey-331623.harry.characters`) as A
+            join (
+                    {mentions}) as B
+            using (char_id)
+    )as A 
+
+    full join (SELECT al.char_id, min(c.Name) as character, s.movie_number as book_number, s.movie_number, count(*) as script_counts
+    FROM `ambient-odyssey-331623.harry.script_v1` as s
+    join `ambient-odyssey-331623.harry.name_alias` as al on al.source = 'script' and al.alias = s.character
+    join `ambient-odyssey-331623.harry.characters` as c on c.Id = al.char_id
+    group by al.char_id, s.movie_number) as B 
+    using (char_id, book_number)
     ) as A
     full join
-    `ambient-odyssey-331623.harry.screen_times_v1` as B
-    on '%' ||B.names||'%' like '%' || A.character ||'%' and A.movie_number = B.movie
+    (select al.char_id, s.*, s.movie as movie_number
+    from `ambient-odyssey-331623.harry.screen_times_v1` as s
+    join `ambient-odyssey-331623.harry.name_alias` as al on al.source = 'screen' and al.alias = s.names) as B
+    using (char_id, movie_number)
     Where Name is not Null order by Name
 
     """
-    df = run_query(q)
+
+# name_alias is derived from the tables below and written back to the dataset, which needs write access,
+# so building it is an explicit step: run build_name_alias() after one of them changes. Reads only check
+# that it is there and not older than them.
+alias_sources = [f'{db}.{t}' for t in ['characters', 'mentions', 'mentions_chapters', 'script_v1', 'screen_times_v1']]
+
+def build_name_alias():
+    """Resolve every character name used in the source tables to characters.Id and store it in name_alias"""
+    chars    = run_query(f'select Id, Name from `{db}.characters`')
+    mentions = pd.concat([run_query(f'select distinct name from `{db}.{t}`')['name'] for t in ['mentions', 'mentions_chapters']])
+    script   = run_query(f'select distinct character from `{db}.script_v1`')['character']
+    screen   = run_query(f'select distinct names from `{db}.screen_times_v1`')['names']
+    return load_table(alias_tbl, df=alias_table(chars, mentions, script, screen))
+
+def check_name_alias():
+    """Raise when name_alias is missing and warn when it is older than a table it is built from"""
+    if not backend.exists(alias_tbl):
+        raise Exception(f'{alias_tbl} does not exist, build it once with datas.build_name_alias()')
+    built, *modified = gather(table_modified, [alias_tbl] + alias_sources)
+    stale = [t for t, m in zip(alias_sources, modified) if m > built]
+    if stale:
+        warnings.warn(f'{alias_tbl} is older than {", ".join(stale)}, rebuild it with datas.build_name_alias()')
+    return alias_tbl
+
+def raw_df():
+    check_name_alias()
+    df = run_query(character_query())
     return df
     
+@traced()
 def clean_df():
-    q = """ select * from(
-    select * from(
-        select *,
-            case 
-        when book = 'philosophers_stone' then 1
-        when book = 'chamber_of_secrets' then 2
-        when book = 'prisoner_of_azkaban' then 3
-        end as book_number
-            from (
-                select *
-                from `ambient-odyssey-331623.harry.characters` as A
-                join (
-                    select name as name_1, book, avg(mentions) as avg_mentions 
-                    from `ambient-odyssey-331623.harry.mentions` 
-                    group by name, book) as B
-                on '%' || B.name_1||'%' like '%' || A.name ||'%'
-    ))as A 
-
-    full join (SELECT character, movie_number, count(*) as script_counts
-    FROM `ambient-odyssey-331623.harry.script_v1` group by character, movie_number) as B 
-    on A.name  like '%' || B.character ||'%' and A.book_number = B.movie_number
-    ) as A
-    full join
-    `ambient-odyssey-331623.harry.screen_times_v1` as B
-    on '%' ||B.names||'%' like '%' || A.character ||'%' and A.movie_number = B.movie
-    Where Name is not Null order by Name
-
-    """
-    df = run_query(q)
-
-    X = (df.drop(columns = ["Id",'Wand',"Loyalty", "Skills", "Patronus","book", 'book_number', 'character', 'names', 'movie',
-                            'name_1','Death']))
-    for i in X.columns:
-        for j in range(X.shape[0]):
-            try: X[i].iloc[j] = X[i].iloc[j].replace('\xa0', ' ')
-            except: continue
-
-    ######################
-    X = X[~X['screen_time_sec'].isna()].reset_index(drop=True)
-    X.columns = X.columns.str.lower()
-    X['hair_colour'] = X['hair_colour'].replace('Silver| formerly auburn', 'Grey').replace('Blond', 'Blonde').replace('Colourless and balding', 'Bald')
-    
-
-    ###############
-    #here we need to clean up all the catagorigal columns 
-    # Start with job, in the books/movies the def against the D.A shows up more so
-    # splits jobs into student, D.A.D.A and other
-
-    X = X.fillna('unknown')
-    X['job_grouped'] = X['job']
-    X['blood_grouped'] = X['blood_status']
-    X['birth_yr'] = 0
-    X['eye_colour'] = X['eye_colour'].replace('Bright green', 'Green').replace('Bright brown', 'Brown').replace('Scarlet ', 'Scarlet') 
-
-    odd_births = {'Vincent Crabbe'     : 1980,
-                  'Minerva McGonagall' : 1889,
-                  'Pomona Sprout'      : 1941,
-                  'Quirinus Quirrell'  : 1967,
-                  'Sir Nicholas'       : 1450,
-                 }
-
-    for i, df in X.iterrows():
-        if df['job'].find('Dark Arts') > -1:
-            X['job_grouped'].iloc[i] = 'defense against the dark arts professor'
-        elif df['job'].find('Student') > -1:
-            X['job_grouped'].iloc[i] = 'student'
-        else:
-            X['job_grouped'].iloc[i] = 'other'
-        if df['blood_status'].find('or') > -1:
-            X['blood_grouped'].iloc[i] = 'magic (unknown)'
-
-        for word in df['birth'].split():
-            if (word.isdigit()) and (int(word)>1880):
-                X['birth_yr'].iloc[i] = int(word)
-
-    for key,item in odd_births.items():
-        idx = X[X['name'] == key].index
-        X.loc[idx, 'birth_yr'] = item
-    X = X.drop(columns = ['job', 'blood_status', 'birth'])
+    check_name_alias()
+    df = run_query(character_query())
+    with stage('character_pipeline', rows_in=len(df)) as st:
+        X = character_pipeline(df)
+        st.rows_out = len(X)
     return X
 
-def mentions_animation():
-    q = """ select * from(
-    select * from(
-        select *,
-            case 
-        when book = 'philosophers_stone' then 1
-        when book = 'chamber_of_secrets' then 2
-        when book = 'prisoner_of_azkaban' then 3
-        end as book_number
-            from (
-                select *
-                from `ambient-odyssey-331623.harry.characters` as A
-                join (
-                    select name as name_1, book, chapter, mentions
-                    from `ambient-odyssey-331623.harry.mentions_chapters` 
-                    ) as B
-                on '%' || B.name_1||'%' like '%' || A.name ||'%'
-    ))as A 
-
-    full join (SELECT character, movie_number, count(*) as script_counts
-    FROM `ambient-odyssey-331623.harry.script_v1` group by character, movie_number) as B 
-    on A.name  like '%' || B.character ||'%' and A.book_number = B.movie_number
-    ) as A
-    full join
-    `ambient-odyssey-331623.harry.screen_times_v1` as B
-    on '%' ||B.names||'%' like '%' || A.character ||'%' and A.movie_number = B.movie
-    Where Name is not Null order by Name
-
-    """
-    df = run_query(q)
-
-    X = (df.drop(columns = ["Id",'Wand',"Loyalty", "Skills", "Patronus","book", 'book_number', 'character', 'names', 'movie',
-                            'name_1','Death']))
-    for i in X.columns:
-        for j in range(X.shape[0]):
-            try: X[i].iloc[j] = X[i].iloc[j].replace('\xa0', ' ')
-            except: continue
-
-    ######################
-    X = X[~X['screen_time_sec'].isna()].reset_index(drop=True)
-    X.columns = X.columns.str.lower()
-    X['hair_colour'] = X['hair_colour'].replace('Silver| formerly auburn', 'Grey').replace('Blond', 'Blonde').replace('Colourless and balding', 'Bald')
-
-
-    ###############
-    #here we need to clean up all the catagorigal columns 
-    # Start with job, in the books/movies the def against the D.A shows up more so
-    # splits jobs into student, D.A.D.A and other
-
-    X = X.fillna('unknown')
-    X['job_grouped'] = X['job']
-    X['blood_grouped'] = X['blood_status']
-    X['birth_yr'] = 0
-    X['eye_colour'] = X['eye_colour'].replace('Bright green', 'Green').replace('Bright brown', 'Brown').replace('Scarlet ', 'Scarlet') 
-
-    odd_births = {'Vincent Crabbe'     : 1980,
-                  'Minerva McGonagall' : 1889,
-                  'Pomona Sprout'      : 1941,
-                  'Quirinus Quirrell'  : 1967,
-                  'Sir Nicholas'       : 1450,
-                 }
-
-    for i, df in X.iterrows():
-        if df['job'].find('Dark Arts') > -1:
-            X['job_grouped'].iloc[i] = 'defense against the dark arts professor'
-        elif df['job'].find('Student') > -1:
-            X['job_grouped'].iloc[i] = 'student'
-        else:
-            X['job_grouped'].iloc[i] = 'other'
-        if df['blood_status'].find('or') > -1:
-            X['blood_grouped'].iloc[i] = 'magic (unknown)'
-
-        for word in df['birth'].split():
-            if (word.isdigit()) and (int(word)>1880):
-                X['birth_yr'].iloc[i] = int(word)
-
-    for key,item in odd_births.items():
-        idx = X[X['name'] == key].index
-        X.loc[idx, 'birth_yr'] = item
-    X = X.drop(columns = ['job', 'blood_status', 'birth'])
-    X['movie_number'] = X['movie_number'].astype('int')
-    X['comb_chapters'] = X['chapter']
-    for i,data in X.iterrows():
-        if data['movie_number'] == 1:
-            X['comb_chapters'].iloc[i] = data['chapter']
-        if data['movie_number'] == 2:
-            X['comb_chapters'].iloc[i] = data['chapter'] + 17
-        if data['movie_number'] == 3:
-            X['comb_chapters'].iloc[i] = data['chapter'] + 17 + 19
-
-    X['comb_chapters'] = X['comb_chapters'].astype('int')
-    X = X.sort_values(['name','house','comb_chapters'])
-    import plotly.express as px
-
-    fig = px.scatter(X, 
-                     x="script_counts",
-                     y="mentions",
-                     size="screen_time_sec",
-                     color="house",
-                     color_discrete_sequence=['red', 'gold' ,'blue','green', 'black'],
-                     category_orders={"house": ['Gryffindor', 'Hufflepuff', 'Ravenclaw','Slytherin','unknown']},
-                     animation_frame="comb_chapters",
-                       hover_name="name",
-                     # log_y=True,
-                     range_x=[-10,400],
-                     range_y=[-10,100],
-
-                     # size_max=60,
-                    )
-    fig.update_layout(title=f'Book Changes at 17 & 36',   width=900, height=700 )
-    fig.show()
\ No newline at end of file
+chapters_query = f"select book, max(chapter) as chapters from `{db}.mentions_chapters` group by book"
+
+def chapter_offsets():
+    """Chapters before each book's first one when all seven are laid end to end, indexed by book_number - 1"""
+    counts = run_query(chapters_query).set_index('book')['chapters'].reindex(books).fillna(0).to_numpy('int64')
+    return np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+def mentions_data():
+    """Cleaned, compacted per chapter mentions frame and the chapter offsets of each book"""
+    check_name_alias()
+    df = run_query(character_query(mentions_chap))
+    with stage('mentions_pipeline', rows_in=len(df)) as st:
+        X = compact(mentions_pipeline(df))
+        st.rows_out, st.bytes = len(X), lambda: frame_bytes(X)
+    return X, chapter_offsets()
+
+def mentions_figure(X, offsets, bucket=1, data=None):
+    """Animated scatter of script lines against mentions per chapter, sized by screen time, from mentions_data
+
+    data is animation_data(X, offsets, bucket) when the caller already has it."""
+    from animation import animation_figure
+
+    with stage('animation_figure', rows_in=len(X)):
+        fig = animation_figure(X, offsets, bucket, data=data)
+    # book_number is dropped by the pipeline, movie_number is the same number for these rows
+    starts = offsets[np.unique(X['movie_number'].to_numpy()) - 1][1:]
+    fig.update_layout(title=f'Book Changes at {" & ".join(map(str, starts))}',   width=900, height=700 )
+    return fig
+
+@traced()
+def mentions_animation(bucket=1):
+    """Animated scatter of script lines against mentions per chapter, sized by screen time
+
+    bucket > 1 merges that many chapters of a book into each frame."""
+    fig = mentions_figure(*mentions_data(), bucket)
+    with stage('show'):
+        fig.show()
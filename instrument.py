@@ -0,0 +1,189 @@
+import os, sys, json, time, atexit, threading
+
+
+# Opt-in instrumentation of the pipeline's stages.
+# Code marks a stage with `with stage('name', rows_in=n) as st: ... st.rows_out = m`. Bytes that are
+# costly to measure are given as a function, `st.bytes = lambda: frame_bytes(df)`, only called when
+# tracing. Nothing is recorded until tracing is enabled, by enable() or by setting
+# HARRY_TRACE=trace.json, which writes the trace there when the process exits. Per stage (keyed by
+# its path of enclosing stages) a trace keeps calls, wall time, rows in / out, bytes and the process'
+# peak RSS. HARRY_PROFILE=cprofile adds the slowest functions of each outermost stage,
+# HARRY_PROFILE=tracemalloc the peak of Python allocations in each stage. python instrument.py
+# old.json new.json compares two traces.
+
+tracer = None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, None where resource is not available"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return kb / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+class Tracer:
+    """Stage totals of one traced run"""
+
+    def __init__(self, path=None, profile=None, top=20):
+        self.path    = path
+        self.profile = profile
+        self.top     = top
+        self.stages  = {}
+        self.local   = threading.local()
+        self.lock    = threading.Lock()
+        self.started = time.time()
+        if profile == 'tracemalloc':
+            import tracemalloc
+            tracemalloc.start()
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def add(self, key, wall, rows_in, rows_out, nbytes, peak, growth, extra):
+        with self.lock:
+            s = self.stages.setdefault(key, {'calls': 0, 'wall_s': 0.0, 'rows_in': 0, 'rows_out': 0, 'bytes': 0,
+                                             'peak_rss_mb': None, 'rss_growth_mb': 0.0})
+            s['calls']  += 1
+            s['wall_s'] += wall
+            s['rows_in']  += rows_in or 0
+            s['rows_out'] += rows_out or 0
+            s['bytes']    += nbytes or 0
+            if peak is not None:
+                s['peak_rss_mb']   = max(s['peak_rss_mb'] or 0, peak)
+                s['rss_growth_mb'] += growth
+            for k, v in extra.items():
+                s[k] = max(s.get(k, 0), v) if k == 'py_peak_mb' else v
+
+    def export(self, path=None):
+        """Write the trace as JSON, stages sorted by key so two traces diff line by line"""
+        path = path or self.path
+        trace = {'started': self.started, 'argv': sys.argv, 'python': sys.version.split()[0],
+                 'profile': self.profile, 'stages': dict(sorted(self.stages.items()))}
+        with open(path, 'w') as f:
+            json.dump(trace, f, indent=1)
+        return path
+
+
+class stage:
+    """Context manager timing one stage; set rows_out / bytes (or a function giving them) on it before it exits"""
+
+    def __init__(self, name, rows_in=None, rows_out=None, bytes=None):
+        self.name     = name
+        self.rows_in  = rows_in
+        self.rows_out = rows_out
+        self.bytes    = bytes
+
+    def __enter__(self):
+        self.tracer = t = tracer
+        if t is None:
+            return self
+        stack = t.stack()
+        self.key   = '/'.join([s.name for s in stack] + [self.name])
+        self.outer = not stack
+        self.py_peak = 0
+        stack.append(self)
+        self.rss = peak_rss_mb()
+        self.prof = None
+        if (t.profile == 'cprofile' and self.outer and threading.current_thread() is threading.main_thread()
+                and sys.getprofile() is None):
+            # only one profiler can be active (per process from Python 3.12 on), so nested stages show up
+            # inside their outermost one and stages of other threads, like prefetch's pages, are not profiled
+            import cProfile
+            self.prof = cProfile.Profile()
+            try:
+                self.prof.enable()
+            except ValueError:
+                # another profiling tool is already running (Python 3.12+, older ones show in getprofile)
+                self.prof = None
+        elif t.profile == 'tracemalloc':
+            import tracemalloc
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        t = self.tracer
+        if t is None:
+            return False
+        wall = time.perf_counter() - self.start
+        extra = {}
+        if self.prof is not None:
+            self.prof.disable()
+            extra['profile'] = top_functions(self.prof, t.top)
+        elif t.profile == 'tracemalloc':
+            import tracemalloc
+            # nested stages reset the peak, so fold theirs back in and hand ours to the parent
+            self.py_peak = max(self.py_peak, tracemalloc.get_traced_memory()[1])
+            extra['py_peak_mb'] = self.py_peak / 2**20
+        stack = t.stack()
+        stack.pop()
+        if stack:
+            stack[-1].py_peak = max(stack[-1].py_peak, self.py_peak)
+        peak = peak_rss_mb()
+        nbytes = self.bytes() if callable(self.bytes) else self.bytes
+        t.add(self.key, wall, self.rows_in, self.rows_out, nbytes, peak,
+              (peak - self.rss) if peak is not None else 0, extra)
+        return False
+
+
+def traced(name=None):
+    """Decorator running the whole function as a stage"""
+    def wrap(fn):
+        def run(*args, **kwargs):
+            with stage(name or fn.__name__):
+                return fn(*args, **kwargs)
+        run.__name__, run.__doc__, run.__wrapped__ = fn.__name__, fn.__doc__, fn
+        return run
+    return wrap
+
+def top_functions(prof, n):
+    """[function, calls, own s, cumulative s] of the n functions with the most cumulative time"""
+    import pstats
+    st = pstats.Stats(prof).stats
+    rows = [(f'{os.path.basename(file)}:{line}({fn})', cc, tt, ct) for (file, line, fn), (cc, nc, tt, ct, _) in st.items()]
+    return [[f, c, round(tt, 6), round(ct, 6)] for f, c, tt, ct in sorted(rows, key=lambda r: -r[3])[:n]]
+
+def frame_bytes(df):
+    """In memory size of a result frame, what a stage reports as bytes fetched"""
+    return int(df.memory_usage(deep=True).sum()) if hasattr(df, 'memory_usage') else 0
+
+
+def enable(path=None, profile=None):
+    """Start recording stages, written to path (if any) when the process exits"""
+    global tracer
+    tracer = Tracer(path, profile)
+    if path:
+        atexit.register(lambda t=tracer: t.export())
+    return tracer
+
+def disable():
+    """Stop recording and return the finished Tracer"""
+    global tracer
+    t, tracer = tracer, None
+    return t
+
+def compare(old, new):
+    """Per stage wall time and peak RSS of two exported traces, largest change first"""
+    a, b = [json.load(open(p))['stages'] for p in (old, new)]
+    rows = []
+    for key in sorted(set(a) | set(b)):
+        wa, wb = a.get(key, {}).get('wall_s', 0), b.get(key, {}).get('wall_s', 0)
+        rows.append((wb - wa, key, wa, wb, a.get(key, {}).get('peak_rss_mb'), b.get(key, {}).get('peak_rss_mb')))
+    for d, key, wa, wb, ra, rb in sorted(rows, key=lambda r: -abs(r[0])):
+        rss = f'{ra or 0:8.0f} -> {rb or 0:6.0f} MB' if ra or rb else ''
+        print(f'{key:<60} {wa:9.3f}s -> {wb:9.3f}s  {d:+9.3f}s  {rss}')
+
+
+if os.environ.get('HARRY_TRACE'):
+    import multiprocessing
+    # pool workers see HARRY_TRACE too, only the main process records and writes the trace
+    if multiprocessing.parent_process() is None:
+        enable(os.environ['HARRY_TRACE'], os.environ.get('HARRY_PROFILE'))
+
+if __name__ == '__main__':
+    compare(sys.argv[1], sys.argv[2])
@@ -0,0 +1,179 @@
+import numpy as np, pandas as pd
+from collections import namedtuple
+from instrument import stage, traced
+
+
+# Linear regression of a character's screen time on the clean_df columns.
+# Categorical columns are ordinal encoded against the levels seen when fitting and then one-hot
+# encoded: a row of the design matrix is one active column per categorical (its codes) next to a
+# short dense block of standardized numeric columns. The model only ever needs the sufficient
+# statistics of that design, X'X, X'y, column sums, sum y and sum y^2, which are built from the
+# codes with bincount and never densify the one-hot block. The intercept is left out of the penalty
+# by centering through those statistics, and the centered X'X is eigendecomposed once, so every
+# ridge alpha after the first is a matrix product. k-fold cross-validation takes each fold's
+# statistics once and gets its training statistics by subtracting them from the total.
+
+one_hot = ['gender', 'house', 'species', 'hair_colour', 'eye_colour', 'job_grouped', 'blood_grouped']
+numeric = ['movie_number', 'avg_mentions', 'script_counts', 'birth_yr']     # movie_number as an ordinal
+target  = 'screen_time_sec'
+
+# codes (n, len(one_hot)) int column of each row's active one-hot entries; numeric (n, len(numeric)) float
+Design = namedtuple('Design', 'codes numeric')
+Stats  = namedtuple('Stats', 'n sy syy s G b')
+
+
+class Encoder:
+    """Levels of the categorical columns and mean / std of the numeric ones, fitted on one frame"""
+
+    def __init__(self, one_hot=one_hot, numeric=numeric):
+        self.one_hot = list(one_hot)
+        self.numeric = list(numeric)
+
+    def fit(self, X):
+        self.levels = [pd.Index(pd.unique(X[c].astype(str))).sort_values() for c in self.one_hot]
+        self.offsets = np.cumsum([0] + [len(l) for l in self.levels])
+        num = self.numeric_block(X)
+        self.mean = np.nanmean(num, axis=0) if len(num) else np.zeros(len(self.numeric))
+        std = np.nanstd(num, axis=0) if len(num) else np.ones(len(self.numeric))
+        self.std = np.where(std > 0, std, 1)
+        return self
+
+    @property
+    def n_one_hot(self):
+        """One-hot columns; column n_one_hot is where levels unseen in fit go, its coefficient is 0"""
+        return int(self.offsets[-1])
+
+    @property
+    def columns(self):
+        """Names of the design's columns, one-hot first"""
+        return [f'{c}={l}' for c, lv in zip(self.one_hot, self.levels) for l in lv] + self.numeric
+
+    def numeric_block(self, X):
+        return np.column_stack([pd.to_numeric(X[c], errors='coerce').to_numpy(dtype=float) for c in self.numeric]) \
+               if self.numeric else np.empty((len(X), 0))
+
+    def transform(self, X):
+        """Design of X; missing numbers become the fitted mean"""
+        codes = np.empty((len(X), len(self.one_hot)), dtype=np.int64)
+        for j, (c, lv) in enumerate(zip(self.one_hot, self.levels)):
+            k = lv.get_indexer(X[c].astype(str))
+            codes[:, j] = np.where(k < 0, self.n_one_hot, k + self.offsets[j])
+        num = (self.numeric_block(X) - self.mean) / self.std
+        return Design(codes, np.nan_to_num(num))
+
+
+def stats(D, y, p):
+    """Sufficient statistics of design D and target y with p one-hot columns, the unseen column left out"""
+    m, q = D.numeric.shape[1], p + 1
+    G = np.zeros((q + m, q + m))
+    # one-hot block: how often two columns are active in the same row, a field pair at a time
+    for i in range(D.codes.shape[1]):
+        G[:q, :q] += np.diag(np.bincount(D.codes[:, i], minlength=q))
+        for j in range(i + 1, D.codes.shape[1]):
+            c = np.bincount(D.codes[:, i] * q + D.codes[:, j], minlength=q * q).reshape(q, q)
+            G[:q, :q] += c + c.T
+    flat, k = D.codes.ravel(), D.codes.shape[1]
+    for j in range(m):
+        G[:q, q + j] = G[q + j, :q] = np.bincount(flat, weights=np.repeat(D.numeric[:, j], k), minlength=q)
+    G[q:, q:] = D.numeric.T @ D.numeric
+    b = np.concatenate([np.bincount(flat, weights=np.repeat(y, k), minlength=q), D.numeric.T @ y])
+    s = np.concatenate([np.bincount(flat, minlength=q), D.numeric.sum(axis=0)]).astype(float)
+    keep = np.r_[:p, q:q + m]
+    return Stats(len(y), y.sum(), y @ y, s[keep], G[np.ix_(keep, keep)], b[keep])
+
+def subtract(a, b):
+    return Stats(*(x - y for x, y in zip(a, b)))
+
+def factorize(st):
+    """Eigendecomposition of the centered X'X and the centered X'y projected onto it"""
+    Gc = st.G - np.outer(st.s, st.s) / st.n
+    c  = st.b - st.s * st.sy / st.n
+    w, V = np.linalg.eigh(Gc)
+    return w, V, V.T @ c
+
+def solve(st, alphas):
+    """(intercepts, coefs) of the ridge fits for every alpha, one row of coefs per alpha
+
+    alpha 0 is ordinary least squares, the minimum norm solution where the one-hot columns are collinear."""
+    w, V, z = factorize(st)
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=float))
+    tol = w.max(initial=0) * len(w) * np.finfo(float).eps
+    d = w[None, :] + alphas[:, None]
+    inv = np.where(d > tol, 1 / np.where(d > tol, d, 1), 0)
+    coefs = (inv * z) @ V.T
+    intercepts = (st.sy - coefs @ st.s) / st.n
+    return intercepts, coefs
+
+def predict_design(D, intercepts, coefs):
+    """(n, alphas) predictions of a design, the one-hot part a gather of coefficients"""
+    p = coefs.shape[1] - D.numeric.shape[1]
+    cat = np.hstack([coefs[:, :p], np.zeros((len(coefs), 1))]).T      # row p: the unseen column
+    return intercepts + cat[D.codes].sum(axis=1) + D.numeric @ coefs[:, p:].T
+
+
+class Regression:
+    """Ridge (alpha > 0) or least squares regression of target on the one_hot and numeric columns"""
+
+    def __init__(self, alpha=0.0, one_hot=one_hot, numeric=numeric, target=target):
+        self.alpha   = alpha
+        self.encoder = Encoder(one_hot, numeric)
+        self.target  = target
+
+    def fit(self, X):
+        X = X[X[self.target].notna()]
+        with stage('fit', rows_in=len(X)):
+            D = self.encoder.fit(X).transform(X)
+            st = stats(D, X[self.target].to_numpy(dtype=float), self.encoder.n_one_hot)
+            (self.intercept,), (self.coef,) = solve(st, self.alpha)
+        return self
+
+    @property
+    def coefficients(self):
+        """Series of coefficients by design column, on the standardized numeric columns"""
+        return pd.Series(self.coef, index=self.encoder.columns)
+
+    def predict(self, X, batch_size=100_000):
+        """Predicted target for every row of X, encoded batch_size rows at a time"""
+        out = np.empty(len(X))
+        with stage('predict', rows_in=len(X), rows_out=len(X)):
+            for i in range(0, len(X), batch_size):
+                D = self.encoder.transform(X.iloc[i:i + batch_size])
+                out[i:i + batch_size] = predict_design(D, np.atleast_1d(self.intercept), self.coef[None])[:, 0]
+        return out
+
+
+def folds(n, k=5, seed=0):
+    """Fold number of each of n rows, as even as possible"""
+    return np.random.default_rng(seed).permutation(np.arange(n) % k)
+
+def cross_validate(X, alphas=(0, 0.1, 1, 10, 100), k=5, seed=0, one_hot=one_hot, numeric=numeric, target=target):
+    """Per alpha, mean and std over k folds of the held out rmse and r2
+
+    The encoder is fitted on all of X, so every fold shares one design; each fold's statistics are
+    computed once and its training statistics are the total minus them."""
+    X = X[X[target].notna()]
+    alphas = np.asarray(alphas, dtype=float)
+    with stage('cross_validate', rows_in=len(X)):
+        enc = Encoder(one_hot, numeric).fit(X)
+        D, y = enc.transform(X), X[target].to_numpy(dtype=float)
+        f = folds(len(y), k, seed)
+        parts = [np.flatnonzero(f == i) for i in range(k)]
+        held = [Design(D.codes[r], D.numeric[r]) for r in parts]
+        fold_st = [stats(h, y[r], enc.n_one_hot) for h, r in zip(held, parts)]
+        total = Stats(*(sum(x) for x in zip(*fold_st)))
+        rmse, r2 = np.empty((k, len(alphas))), np.empty((k, len(alphas)))
+        for i, (h, r, st) in enumerate(zip(held, parts, fold_st)):
+            pred = predict_design(h, *solve(subtract(total, st), alphas))
+            err = ((pred - y[r, None]) ** 2).sum(axis=0)
+            rmse[i] = np.sqrt(err / len(r))
+            r2[i] = 1 - err / max(((y[r] - y[r].mean()) ** 2).sum(), np.finfo(float).tiny)
+    return pd.DataFrame({'alpha': alphas, 'rmse': rmse.mean(0), 'rmse_std': rmse.std(0),
+                         'r2': r2.mean(0), 'r2_std': r2.std(0)})
+
+@traced()
+def fit_screen_time(alphas=(0, 0.1, 1, 10, 100), k=5):
+    """Regression of screen time on clean_df, with the alpha of lowest cross-validated rmse"""
+    import datas
+    X = datas.clean_df()
+    cv = cross_validate(X, alphas, k=min(k, int(X[target].notna().sum())))
+    return Regression(cv.loc[cv['rmse'].idxmin(), 'alpha']).fit(X), cv
@@ -0,0 +1,46 @@
+import os, contextlib, numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from instrument import stage
+
+
+# Sentence sentiment scoring.
+# TextBlob(s).polarity and TextBlob(s).subjectivity both come from the default PatternAnalyzer, so each
+# sentence is analysed once straight through the analyzer. Sentences are scored in batches, fanned
+# out over a process pool when workers > 1, and returned as float64 NumPy arrays.
+
+analyzer = None
+
+def score_batch(sentences):
+    """(n, 2) array of polarity, subjectivity for a list of sentences"""
+    global analyzer
+    if analyzer is None:
+        from textblob.en.sentiments import PatternAnalyzer
+        analyzer = PatternAnalyzer()
+    out = np.empty((len(sentences), 2))
+    for k, s in enumerate(sentences):
+        out[k] = analyzer.analyze(s)
+    return out
+
+def default_workers():
+    """HARRY_WORKERS if set, else every core"""
+    return int(os.environ.get('HARRY_WORKERS', os.cpu_count() or 1))
+
+def open_pool(workers=None):
+    """Process pool to pass to score() across many calls, None (in a context) when scoring in process"""
+    workers = workers or default_workers()
+    return ProcessPoolExecutor(workers) if workers > 1 else contextlib.nullcontext()
+
+def score(sentences, workers=None, batch_size=5000, pool=None):
+    """Polarity and subjectivity arrays for sentences, scored in batches over workers processes"""
+    workers = workers or default_workers()
+    batches = [sentences[k:k + batch_size] for k in range(0, len(sentences), batch_size)]
+    with stage('score', rows_in=len(sentences), rows_out=len(sentences)):
+        if pool is not None:
+            res = list(pool.map(score_batch, batches))
+        elif workers == 1 or len(batches) <= 1:
+            res = [score_batch(b) for b in batches]
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                res = list(pool.map(score_batch, batches))
+    res = np.concatenate(res) if res else np.empty((0, 2))
+    return res[:, 0], res[:, 1]
@@ -1,114 +1,49 @@
-import os, pathlib, google, numpy as np, pandas as pd
-from google.cloud import bigquery
-import plotly.graph_objects as go
-import plotly.express as px
+import contextlib, numpy as np, pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+import datas
+from datas import get_cols, iter_query, table_modified, gather, prefetch, timed_pages, db, books
+from instrument import stage, traced
+from aliases import normalize_names
+from scoring import score, open_pool, default_workers
+from splitter import split_into_sentences
+from store import default_store, text_hash
 # import dash
 # from dash import dcc
 # from dash import html
 # from dash.dependencies import Input, Output
 
-def make_sentiment_plt():
-    # bigquery_storage is not built into Vertex AI, so we install if necessary.
-    # try-except an extrememly useful python feature.  Here, we first try to import from bigquery_storage
-    # If that works, program moves on.  If that fails because it's not installed, we pip install it from https://pypi.org/.
-    try:
-        from google.cloud.bigquery_storage import BigQueryReadClient
-    except:
-        os.system('pip install --upgrade google-cloud-bigquery-storage')
-        from google.cloud.bigquery_storage import BigQueryReadClient
-
-    # Create connection to BigQuery
-    cred, proj = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
-    bqclient   = bigquery.Client(credentials=cred, project=proj)
-
-
-    # Define useful functions to interact with BigQuery
-    def get_cols(tbl):
-        """Get list of columns on tbl"""
-        t = bqclient.get_table(tbl)
-        return [s.name for s in t.schema]
-
-    def run_query(query):
-        """Run sql query and return pandas dataframe of results, if any"""
-        res = bqclient.query(query).result()
-        try:
-            return res.to_dataframe()
-        except:
-            return True
-
-    def head(tbl, rows=10):
-        """Display the top rows of tbl"""
-        query = f'select * from {tbl} limit {rows}'
-        df = run_query(query)
-        print(df)
-        return df
-
-    def delete_table(tbl):
-        """Delete tbl if it exists"""
-        query = f'drop table {tbl}'
-        try:
-            run_query(query)
-        except google.api_core.exceptions.NotFound:
-            pass
-
-    def load_table(tbl, df=None, query=None, file=None, overwrite=True, preview_rows=0):
-        """Load data into tbl either from a pandas dataframe, sql query, or local csv file"""
-
-        if overwrite:
-            delete_table(tbl)
-
-        if df is not None:
-            job = bqclient.load_table_from_dataframe(df, tbl).result()
-        elif query is not None:
-            job = bqclient.query(query, job_config=bigquery.QueryJobConfig(destination=tbl)).result()
-        elif file is not None:
-            with open(file, mode='rb') as f:
-                job = bqclient.load_table_from_file(f, tbl, job_config=bigquery.LoadJobConfig(autodetect=True)).result()
-        else:
-            raise Exception('at least one of df, query, or file must be specified')
-
-        if preview_rows > 0:
-            head(tbl, preview_rows)
-        return tbl
-
-
-    def subquery(query, indents=1):
-        s = '\n' + indents * '    '
-        return query.strip().replace('\n', s)
-
-    def print_query(query, final_only=False):
-        if final_only:
-            print(query[-1])
-        else:
-            for k, q in enumerate(query):
-                print(f'stage {k}')
-                print(q)
-                print('===============================================================================')
-    rng = np.random.default_rng(42)
-
-    db  = 'ambient-odyssey-331623.harry'
-
-    mv = (['philosophers_stone','chamber_of_secrets', 'prisoner_of_azkaban', 'goblet_of_fire', 
-      'order_of_the_phoenix','half_blood_prince', 'deathly_hallows' ])
-
-    cols = get_cols(f"{db}.book_{mv[1]}")
+movies = books[:3]
+
+book_tables  = [f'{db}.book_{b}' for b in books]
+movie_tables = [f'{db}.movie_{m}' for m in movies]
+
+def book_query(cols=None, numbers=None):
+    """Paragraphs of all seven books (or the book_numbers in numbers) with their book_number,
+    cols are the book tables' columns"""
+    cols = cols or get_cols(f"{db}.book_{books[1]}")
 
     q = ""
-    for i,j in enumerate(mv):
+    for i,j in enumerate(books):
+        if numbers is not None and i + 1 not in numbers:
+            continue
         q += f"""select 
         {(', ').join(cols).lower()},
         {i+1} as book_number,
 
         from {db}.book_{j} union all\n"""
 
-    q = q[:-10]
-    book_df = run_query(q)
+    return q[:-10]
 
-    mv = ['philosophers_stone','chamber_of_secrets', 'prisoner_of_azkaban']
-    cols = get_cols(f"{db}.movie_{mv[1]}")[1:]
+def movie_query(cols=None, numbers=None):
+    """Script lines of the three movies (or the movie_numbers in numbers) with their movie_number,
+    cols are the movie tables' columns"""
+    cols = (cols or get_cols(f"{db}.movie_{movies[1]}"))[1:]
 
     q = ""
-    for i,j in enumerate(mv):
+    for i,j in enumerate(movies):
+        if numbers is not None and i + 1 not in numbers:
+            continue
         q += f"""select 
         concat(upper(left(character,1)),'',lower(substring(character,2,char_length(trim(character))))) as character,
         {(', ').join(cols).lower()},
@@ -116,117 +51,197 @@ def make_sentiment_plt():
 
         from {db}.movie_{j} union all\n"""
 
-    q = q[:-10]
-    df = run_query(q)
-
-    for i in range(df.shape[0]):
-        df['character'].iloc[i] = df['character'].iloc[i].replace('\n', '')
-        df['character'].iloc[i] = df['character'].iloc[i].replace('  ', ' ')
-        if df['character'].iloc[i][-1] == ' ':
-            df['character'].iloc[i] = df['character'].iloc[i][:-1]
-        df['character'].iloc[i] = df['character'].iloc[i].replace('\xa0', ' ')
-
-        d = {'Oiiver'             : 'Oliver wood',
-         'Oliver'             : 'Oliver wood',
-         'Wood'               : 'Oliver wood',
-         'stan shunpike'      : "Stan shunpike",
-         'Lockhart'           : 'Gilderoy lockhart',
-         'Harry-ron-hermione' : 'All 3',
-         'All'                : 'All 3',
-         'Ron and harry'      : 'Harry and ron',
-         'Tom'                : 'Tom riddle',
-         'Vernon'             : 'Uncle vernon'
-    }
-
-    for i in range(df.shape[0]):
-        try:
-            char = d[df['character'].iloc[i]]
-            df['character'].iloc[i] = char
-        except:
-            continue
-    df = df.sort_values('character')
-
-    import re
-    alphabets= "([A-Za-z])"
-    prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
-    suffixes = "(Inc|Ltd|Jr|Sr|Co)"
-    starters = "(Mr|Mrs|Ms|Dr|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s|This\s|Wherever)"
-    acronyms = "([A-Z][.][A-Z][.](?:[A-Z][.])?)"
-    websites = "[.](com|net|org|io|gov)"
-
-    def split_into_sentences(text):
-        text = " " + text + "  "
-        text = text.replace("\n"," ")
-        text = re.sub(prefixes,"\\1<prd>",text)
-        text = re.sub(websites,"<prd>\\1",text)
-        if "Ph.D" in text: text = text.replace("Ph.D.","Ph<prd>D<prd>")
-        text = re.sub("\s" + alphabets + "[.] "," \\1<prd> ",text)
-        text = re.sub(acronyms+" "+starters,"\\1<stop> \\2",text)
-        text = re.sub(alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]","\\1<prd>\\2<prd>\\3<prd>",text)
-        text = re.sub(alphabets + "[.]" + alphabets + "[.]","\\1<prd>\\2<prd>",text)
-        text = re.sub(" "+suffixes+"[.] "+starters," \\1<stop> \\2",text)
-        text = re.sub(" "+suffixes+"[.]"," \\1<prd>",text)
-        text = re.sub(" " + alphabets + "[.]"," \\1<prd>",text)
-        if "”" in text: text = text.replace(".”","”.")
-        if "\"" in text: text = text.replace(".\"","\".")
-        if "!" in text: text = text.replace("!\"","\"!")
-        if "?" in text: text = text.replace("?\"","\"?")
-        text = text.replace(".",".<stop>")
-        text = text.replace("?","?<stop>")
-        text = text.replace("!","!<stop>")
-        text = text.replace("<prd>",".")
-        sentences = text.split("<stop>")
-        sentences = sentences[:-1]
-        sentences = [s.strip() for s in sentences]
-        return sentences
-
-    from textblob import TextBlob
-
-    ls = []
-    for i, data in df.groupby('movie_number'):
-        data = data.reset_index(drop=True)
-        for j in range(data.shape[0]):
-            s = data['sentence'].iloc[j]
-            ss = split_into_sentences(s)
-            for j in ss:
-                ls.append([TextBlob(j).polarity, TextBlob(j).subjectivity, 'movie',i])
-
-    hdf_movies = pd.DataFrame(ls, columns= ['polarity', 'subjectivity', 'media', 'series_number'])
-
-    ls = []
-    for i, data in book_df.groupby('book_number'):
-        data = data.reset_index(drop=True)
-        for j in range(data.shape[0]):
-            s = data['script'].iloc[j]
-            ss = split_into_sentences(s)
-            for j in ss:
-                ls.append([TextBlob(j).polarity, TextBlob(j).subjectivity, 'book',i])
-    hdf_books = pd.DataFrame(ls, columns= ['polarity', 'subjectivity', 'media', 'series_number'])
-    hdf = pd.concat([hdf_books,hdf_movies]).reset_index(drop= True)
-
-    dfs = hdf
- 
-    dfs['series_nm'] = dfs['series_number']
-    bks = (['philosophers_stone','chamber_of_secrets', 'prisoner_of_azkaban', 'goblet_of_fire', 
-          'order_of_the_phoenix','half_blood_prince', 'deathly_hallows' ])
-    for i in range(dfs.shape[0]):
-        dfs['series_nm'].iloc[i] = bks[dfs['series_nm'].iloc[i]-1]
-    
-    dfs = list(hdf.query("polarity != 0 & subjectivity != 0").groupby(['series_nm',"media"]))
-
-    first_title = dfs[0][0]
+    return q[:-10]
+
+def clean_movie_characters(df):
+    """Tidy the character column of a page of movie lines and resolve aliases"""
+    return df.reset_index(drop=True).assign(character=lambda d: normalize_names(d['character']))
+
+def stream_sentences(pages, text_col, series_col, prep=None):
+    """Yield (sentences, series numbers) for each page of query results"""
+    for page in pages:
+        with stage('split', rows_in=len(page)) as st:
+            if prep is not None:
+                page = prep(page)
+            sents, series = [], []
+            for s, i in zip(page[text_col], page[series_col]):
+                ss = split_into_sentences(s)
+                sents  += ss
+                series += [i] * len(ss)
+            st.rows_out = len(sents)
+        yield sents, series
+
+def sources():
+    """(query, text column, series column, media, page prep, tables read) for books and movies"""
+    book_cols, movie_cols = gather(get_cols, [book_tables[1], movie_tables[1]])
+    return [(book_query(book_cols), 'script', 'book_number', 'book', None, book_tables),
+            (movie_query(movie_cols), 'sentence', 'movie_number', 'movie', clean_movie_characters, movie_tables)]
+
+def update_store(store, workers=None, rows=5000):
+    """Score only the book / movie rows whose text store has not seen and forget rows that are gone
+
+    A media whose tables have not changed since the last update is not read at all."""
+    todo = []
+    # an error part way stops every prefetch, read or not
+    with contextlib.ExitStack() as prefetches, open_pool(workers) as pool:
+        for src in sources():
+            version = str(gather(table_modified, src[-1]))
+            if store.version(src[3]) != version:
+                # every query that is needed starts downloading now
+                todo.append((src, version, prefetches.enter_context(prefetch(iter_query(src[0], rows)))))
+
+        for (q, text_col, series_col, m, prep, tables), version, pages in todo:
+            known, seen = store.known(m), Counter()
+            for page in timed_pages(pages, 'wait for page'):
+                with stage('split new text', rows_in=len(page)) as st:
+                    if prep is not None:
+                        page = prep(page)
+                    new = []
+                    for text, i in zip(page[text_col], page[series_col]):
+                        key = (int(i), text_hash(text))
+                        if key not in known and key not in seen:
+                            new.append((key, text))
+                        seen[key] += 1
+                    sents, owner = [], []
+                    for n, (key, text) in enumerate(new):
+                        ss = split_into_sentences(text)
+                        sents += ss
+                        owner += [n] * len(ss)
+                    st.rows_out = len(sents)
+                if new:
+                    p, s = score(sents, workers=1, pool=pool)
+                    with stage('store add', rows_in=len(sents)):
+                        store.add(m, [key for key, _ in new], owner, p, s)
+            store.set_copies(m, seen)
+            store.set_version(m, version)
+    return store
+
+def sentiment_frame(workers=None, rows=5000, store=None, partitioned=False, corpus=None):
+    """polarity / subjectivity of every book and movie sentence
+
+    By default results are read rows at a time and split and scored while the next pages download,
+    so only the scores and a few pages of text are held, never all of it. The other ways are
+    exclusive, passing more than one of them raises ValueError:
+    store        only new or changed text is scored and the rest is loaded from the SentimentStore
+    partitioned  True hands each book and movie whole to a worker process (see partitioned_frame)
+    corpus       sentences are read from the Corpus' memory-mapped files, brought up to date first;
+                 True uses the default Corpus (see corpus.default_corpus)"""
+    chosen = [name for name, v in [('store', store), ('partitioned', partitioned), ('corpus', corpus)]
+              if v is not None and v is not False]
+    if len(chosen) > 1:
+        raise ValueError(f'sentiment_frame takes one of store, partitioned and corpus, got {" and ".join(chosen)}')
+    if 'corpus' in chosen:
+        from corpus import build_corpus, corpus_frame
+        return corpus_frame(build_corpus(corpus, rows), workers)
+    if store is not None:
+        update_store(store, workers, rows)
+        with stage('store load') as st:
+            hdf = store.load()
+            st.rows_out = len(hdf)
+        return hdf
+    if partitioned:
+        return partitioned_frame(workers, rows)
+
+    polarity, subjectivity, series, media = [], [], [], []
+    srcs = sources()
+    with contextlib.ExitStack() as prefetches, open_pool(workers) as pool:
+        # both queries start downloading now, and stay a few pages ahead of the scoring
+        pages = [prefetches.enter_context(prefetch(iter_query(q, rows))) for q, *_ in srcs]
+        for (q, text_col, series_col, m, prep, _), pp in zip(srcs, pages):
+            n = 0
+            for sents, ser in stream_sentences(timed_pages(pp, 'wait for page'), text_col, series_col, prep):
+                p, s = score(sents, workers=1, pool=pool)
+                polarity.append(p)
+                subjectivity.append(s)
+                series.append(np.asarray(ser, dtype=np.int16))
+                n += len(ser)
+            media.append(np.full(n, m, dtype=object))
+
+    cat = lambda ls, dtype: np.concatenate(ls) if ls else np.empty(0, dtype)
+    return pd.DataFrame({'polarity'     : cat(polarity, float),
+                         'subjectivity' : cat(subjectivity, float),
+                         'media'        : cat(media, object),
+                         'series_number': cat(series, np.int16).astype(int)})
+
+def partitions():
+    """(media, series number, query, text column, series column, page prep) for every book and movie"""
+    book_cols, movie_cols = gather(get_cols, [book_tables[1], movie_tables[1]])
+    return ([('book', n, book_query(book_cols, [n]), 'script', 'book_number', None) for n in range(1, len(books) + 1)] +
+            [('movie', n, movie_query(movie_cols, [n]), 'sentence', 'movie_number', clean_movie_characters)
+             for n in range(1, len(movies) + 1)])
+
+def partition_worker(backend, cache):
+    """Pool initializer, workers read through the parent's backend and cache"""
+    datas.set_backend(backend)
+    datas.set_cache(cache)
+
+def score_partition(part, rows=5000):
+    """Load, split and score one book or movie, returning (polarity, subjectivity) float64 arrays
+
+    Plain NumPy arrays go back to the parent as raw buffers instead of a pickled DataFrame; the
+    series number and media are the partition's own."""
+    media, number, q, text_col, series_col, prep = part
+    polarity, subjectivity = [], []
+    for sents, _ in stream_sentences(iter_query(q, rows), text_col, series_col, prep):
+        p, s = score(sents, workers=1)
+        polarity.append(p)
+        subjectivity.append(s)
+    cat = lambda ls: np.concatenate(ls) if ls else np.empty(0)
+    return cat(polarity), cat(subjectivity)
+
+def partitioned_frame(workers=None, rows=5000):
+    """sentiment_frame with every book and movie loaded, split and scored in its own pool task
+
+    Partitions are merged back in book then movie order, so the frame equals sentiment_frame's."""
+    parts = partitions()
+    workers = workers or default_workers()
+    if workers > 1:
+        with ProcessPoolExecutor(workers, initializer=partition_worker, initargs=(datas.backend, datas.cache)) as pool:
+            res = list(pool.map(score_partition, parts, [rows] * len(parts)))
+    else:
+        res = [score_partition(part, rows) for part in parts]
+
+    sizes = [len(p) for p, _ in res]
+    return pd.DataFrame({'polarity'     : np.concatenate([p for p, _ in res]),
+                         'subjectivity' : np.concatenate([s for _, s in res]),
+                         'media'        : np.repeat(np.array([part[0] for part in parts], dtype=object), sizes),
+                         'series_number': np.repeat([part[1] for part in parts], sizes)})
+
+def sentiment_bins(hdf, bins=(40, 20)):
+    """Polarity x subjectivity counts for every (series name, media) group, in one histogram pass
+
+    Returns the group names in groupby order, the x and y bin edges and a (groups, y bins, x bins)
+    count array. Sentences with zero polarity and subjectivity are left out as before."""
+    hdf = hdf.query("polarity != 0 & subjectivity != 0")
+    # integer (series, media) keys, renumbered so groups come out in (series name, media) order
+    media, kinds = pd.factorize(hdf['media'], sort=True)
+    key    = (hdf['series_number'].to_numpy() - 1) * len(kinds) + media
+    used   = np.flatnonzero(np.bincount(key))
+    groups = [(books[k // len(kinds)], kinds[k % len(kinds)]) for k in used]
+    order  = sorted(range(len(groups)), key=groups.__getitem__)
+    relabel = np.empty(used[-1] + 1 if len(used) else 0, dtype=np.int64)
+    relabel[used[order]] = np.arange(len(used))
+    codes, groups = relabel[key], [groups[k] for k in order]
+    counts, (_, y, x) = np.histogramdd(np.column_stack([codes, hdf['subjectivity'], hdf['polarity']]),
+                                       bins=[len(groups), bins[1], bins[0]],
+                                       range=[(-0.5, len(groups) - 0.5), (0, 1), (-1, 1)])
+    return groups, x, y, counts.astype(np.int64)
+
+def sentiment_figure(hdf, bins=(40, 20), binned=None):
+    """Heatmap per (series name, media) with a dropdown to switch between them
+
+    binned is sentiment_bins(hdf, bins) when the caller already has it."""
+    import plotly.graph_objects as go
+    groups, x, y, counts = sentiment_bins(hdf, bins) if binned is None else binned
+    xc, yc = (x[:-1] + x[1:]) / 2, (y[:-1] + y[1:]) / 2
+
     traces = []
     buttons = []
-    for i,d in enumerate(dfs):
-        visible = [False] * len(dfs)
+    for i, name in enumerate(groups):
+        visible = [False] * len(groups)
         visible[i] = True
-        name = d[0]
-        # print(d[1])
-        traces.append(
-            px.density_heatmap(d[1], x="polarity", y="subjectivity", range_x= [-1,1], range_y = [0,1]
-
-                     ).update_traces(visible=True if i==0 else False).data[0]
-        )
+        traces.append(go.Heatmap(z=counts[i], x=xc, y=yc, coloraxis='coloraxis', visible=i == 0,
+                                 hovertemplate='polarity=%{x}<br>subjectivity=%{y}<br>count=%{z}<extra></extra>'))
         buttons.append(dict(label=f'{name}',
                             method="update",
                             args=[{"visible":visible},
@@ -235,7 +250,25 @@ def make_sentiment_plt():
     updatemenus = [{'active':0, "buttons":buttons}]
 
     fig = go.Figure(data=traces, layout=dict(updatemenus=updatemenus))
-    fig.update_layout(title=f'{first_title}', title_x=0.5,   width=900, height=700,
+    fig.update_layout(title=f'{groups[0]}', title_x=0.5,   width=900, height=700,
                       xaxis_title="polarity",
-                        yaxis_title="subjectivity", )
-    fig.show()
\ No newline at end of file
+                        yaxis_title="subjectivity", xaxis_range=[-1, 1], yaxis_range=[0, 1])
+    return fig
+
+@traced()
+def make_sentiment_plt(workers=None, rows=5000, store=True, bins=(40, 20), partitioned=False, corpus=None):
+    """Density heatmaps of sentence polarity against subjectivity per book and movie
+
+    store=True keeps scores in the default SentimentStore, pass a SentimentStore to use another
+    one or None to rescore everything. partitioned=True rescores everything one book / movie per
+    process and corpus (True for the default one, or a Corpus) scores the memory-mapped corpus, so
+    both need store=None; with the store they raise ValueError (see sentiment_frame).
+    bins is the number of (polarity, subjectivity) bins."""
+    for name, v in [('partitioned', partitioned), ('corpus', corpus)]:
+        if v is not None and v is not False and store is not None:
+            raise ValueError(f'{name} rescores everything and cannot use the store, pass store=None with it')
+    hdf = sentiment_frame(workers, rows, default_store() if store is True else store, partitioned, corpus)
+    with stage('sentiment_figure', rows_in=len(hdf)):
+        fig = sentiment_figure(hdf, bins)
+    with stage('show'):
+        fig.show()
@@ -0,0 +1,218 @@
+import re, sys, json, gzip, time, hashlib, threading, numpy as np
+from collections import namedtuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import datas, sentiment
+from animation import animation_data
+from store import SentimentStore, default_store
+from instrument import stage
+
+
+# Long-running server for the figures and the aggregates behind them.
+# python server.py [port [interval]]   serves on 127.0.0.1:port (8050), checking sources every interval s (60)
+#
+# GET /sentiment/figure   heatmap figure JSON, as make_sentiment_plt shows it
+#     /sentiment/bins     {groups, x, y, counts} polarity x subjectivity counts per book / movie
+#     /mentions/figure    animated mentions scatter figure JSON, as mentions_animation shows it
+#     /mentions/data      {points, frames, values} behind the animation, null where a character has no row
+#     /status             source versions and build times
+#
+# Every response body is built once, gzipped once and tagged with a hash of its bytes, so a request is
+# a dictionary lookup; a client sending the ETag back in If-None-Match gets a 304 without a body. A
+# background thread compares the source tables' modified times with the ones each group of resources
+# was built from every interval seconds and rebuilds only the groups whose tables changed. Sentiment
+# goes through a SentimentStore, so a rebuild scores only new text. Old bodies are served until their
+# replacement is ready.
+
+Resource = namedtuple('Resource', 'body gzipped etag')
+
+table_names = re.compile(r'`?([\w-]+\.\w+\.\w+)`?')
+
+def tables_in(*queries):
+    """Fully qualified tables read by queries"""
+    return sorted({t for q in queries for t in table_names.findall(q)})
+
+def to_json(obj):
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+def nan_to_null(a, decimals=6):
+    """Nested lists of a float array with NaN as None, which json writes as null"""
+    a = np.round(np.asarray(a, dtype=float), decimals)
+    return np.where(np.isnan(a), None, a).tolist()
+
+def accepts_gzip(header):
+    """Whether an Accept-Encoding header takes gzip, going by its q-values: gzip;q=0 refuses it"""
+    q = {}
+    for part in header.split(','):
+        coding, *params = [p.strip() for p in part.split(';')]
+        weight = 1.0
+        for p in params:
+            k, _, v = p.partition('=')
+            if k.strip().lower() == 'q':
+                try:
+                    weight = float(v)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            q[coding.lower()] = weight
+    return q.get('gzip', q.get('x-gzip', q.get('*', 0))) > 0
+
+def resource(body):
+    return Resource(body, gzip.compress(body, 6), f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"')
+
+
+class App:
+    """Resources by path, rebuilt by refresh() when their source tables change"""
+
+    def __init__(self, interval=60, bucket=1, bins=(40, 20), workers=None, rows=5000, store=None):
+        self.interval  = interval
+        self.bucket    = bucket
+        self.bins      = bins
+        self.workers   = workers
+        self.rows      = rows
+        self.store_path = store
+        self.store     = None        # SQLite connections stay on the thread that opened them, see refresh
+        self.resources = {}
+        self.versions  = {}
+        self.built     = {}
+        self.errors    = {}
+        self.ready     = threading.Event()
+        self.stopped   = threading.Event()
+        self.groups    = {'sentiment': (lambda: sentiment.book_tables + sentiment.movie_tables, self.build_sentiment,
+                                        ['/sentiment/figure', '/sentiment/bins']),
+                          'mentions' : (lambda: tables_in(datas.character_query(datas.mentions_chap), datas.chapters_query),
+                                        self.build_mentions, ['/mentions/figure', '/mentions/data'])}
+
+    def build_sentiment(self):
+        if self.store is None:
+            self.store = SentimentStore(self.store_path) if self.store_path else default_store()
+        hdf = sentiment.sentiment_frame(self.workers, self.rows, self.store)
+        binned = groups, x, y, counts = sentiment.sentiment_bins(hdf, self.bins)
+        with stage('sentiment_figure', rows_in=len(hdf)):
+            fig = sentiment.sentiment_figure(hdf, self.bins, binned)
+        return {'/sentiment/figure': fig.to_json().encode(),
+                '/sentiment/bins'  : to_json({'groups': [list(g) for g in groups], 'x': x.tolist(), 'y': y.tolist(),
+                                              'counts': counts.tolist()})}
+
+    def build_mentions(self):
+        X, offsets = datas.mentions_data()
+        data = points, frames, values = animation_data(X, offsets, self.bucket)
+        fig = datas.mentions_figure(X, offsets, self.bucket, data)
+        return {'/mentions/figure': fig.to_json().encode(),
+                '/mentions/data'  : to_json({'points': points.to_dict('list'),
+                                             'frames': frames[['label', 'book', 'chapter']].astype(object).to_dict('list'),
+                                             'columns': ['script_counts', 'mentions', 'screen_time_sec'],
+                                             'values': nan_to_null(values)})}
+
+    def refresh(self):
+        """Rebuild the groups whose source tables changed since they were built, returning their names"""
+        done = []
+        for name, (tables, build, _) in self.groups.items():
+            try:
+                version = str(datas.gather(datas.table_modified, tables()))
+                if self.versions.get(name) == version:
+                    continue
+                with stage(f'refresh {name}'):
+                    new = {path: resource(body) for path, body in build().items()}
+                # one assignment, so a request sees either every old body of the group or every new one
+                self.resources = {**self.resources, **new}
+                self.versions[name], self.built[name] = version, time.time()
+                self.errors.pop(name, None)
+                done.append(name)
+            except Exception as e:
+                # keep serving what was built before, try again next interval
+                self.errors[name] = repr(e)
+                print(f'refresh {name} failed: {e!r}', file=sys.stderr)
+        return done
+
+    def run(self):
+        """Refresh every interval seconds until stop()"""
+        while not self.stopped.is_set():
+            self.refresh()
+            self.ready.set()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+    def status(self):
+        return to_json({'ready': self.ready.is_set(), 'versions': self.versions, 'built': self.built,
+                        'errors': self.errors, 'resources': sorted(self.resources)})
+
+    def expected(self, path):
+        return any(path in paths for *_, paths in self.groups.values())
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'     # keep-alive, every response has a Content-Length
+    # headers and body are separate writes, Nagle would hold the body back until the headers' delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def respond(self, head):
+        app  = self.server.app
+        path = self.path.split('?', 1)[0].rstrip('/') or '/'
+        if path == '/status':
+            return self.send(200, app.status(), head, cache=False)
+        res = app.resources.get(path)
+        if res is None:
+            if app.expected(path):
+                return self.send(503, to_json({'error': 'not built yet'}), head, {'Retry-After': '5'}, cache=False)
+            return self.send(404, to_json({'error': f'no resource {path}'}), head, cache=False)
+        # the gzipped body is another representation, so it gets its own ETag
+        gz   = accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        etag = res.etag[:-1] + '-gzip"' if gz else res.etag
+        tags = [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]
+        if etag in tags or '*' in tags:
+            return self.send(304, b'', head, {'ETag': etag})
+        if gz:
+            return self.send(200, res.gzipped, head, {'ETag': etag, 'Content-Encoding': 'gzip'})
+        self.send(200, res.body, head, {'ETag': etag})
+
+    def send(self, code, body, head, headers={}, cache=True):
+        self.send_response(code)
+        if code != 304:
+            self.send_header('Content-Type', 'application/json')
+        # clients may keep a body but must check its ETag before using it again
+        self.send_header('Cache-Control', 'no-cache' if cache else 'no-store')
+        self.send_header('Vary', 'Accept-Encoding')
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(app, host='127.0.0.1', port=8050, verbose=False):
+    """HTTP server on (host, port) serving app's resources, a thread per connection; port 0 picks a free one"""
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    httpd.app, httpd.verbose = app, verbose
+    return httpd
+
+def serve(port=8050, host='127.0.0.1', interval=60, **kwargs):
+    """Build everything, then serve it while a background thread keeps it up to date"""
+    app = App(interval, **kwargs)
+    threading.Thread(target=app.run, daemon=True).start()
+    httpd = make_server(app, host, port, verbose=True)
+    print(f'serving on http://{host}:{httpd.server_address[1]}, building resources', file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app.stop()
+        httpd.server_close()
+
+
+if __name__ == '__main__':
+    serve(*[int(a) for a in sys.argv[1:2]], interval=float(sys.argv[2]) if len(sys.argv) > 2 else 60)
@@ -0,0 +1,97 @@
+import re
+
+
+# Sentence splitter, same output as the split_into_sentences that used to live in make_sentiment_plt.
+# The old version marked protected dots with "<prd>" and boundaries with "<stop>", growing a new copy
+# of the text on every pass. Here the patterns are compiled once and every rewrite keeps the text
+# length: a protected dot becomes PRD, a dot the old rules deleted becomes DEL and inserted
+# boundaries are only recorded as offsets. One scan for . ? ! then gives every sentence boundary,
+# and sentences come out as (start, end) offsets into the original text or as strings on demand.
+
+alphabets= "([A-Za-z])"
+prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
+suffixes = "(Inc|Ltd|Jr|Sr|Co)"
+starters = "(Mr|Mrs|Ms|Dr|He\\s|She\\s|It\\s|They\\s|Their\\s|Our\\s|We\\s|But\\s|However\\s|That\\s|This\\s|Wherever)"
+acronyms = "([A-Z][.][A-Z][.](?:[A-Z][.])?)"
+websites = "[.](com|net|org|io|gov)"
+
+PRD, DEL = '\x00', '\x01'
+
+prefix_re   = re.compile(prefixes)
+website_re  = re.compile(websites)
+initial_re  = re.compile("\\s" + alphabets + "[.] ")
+acr_stop_re = re.compile(acronyms + " " + starters)
+abc_re      = re.compile(alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]")
+ab_re       = re.compile(alphabets + "[.]" + alphabets + "[.]")
+suf_stop_re = re.compile(" " + suffixes + "[.] " + starters)
+suffix_re   = re.compile(" " + suffixes + "[.]")
+letter_re   = re.compile(" " + alphabets + "[.]")
+end_re      = re.compile("[.?!]")
+# every acronym / abbreviation rule needs a dot directly followed by a letter
+dot_alpha   = re.compile("[.][A-Za-z]")
+
+restore = str.maketrans({PRD: '.', DEL: None})
+
+
+def mark(text):
+    """Working copy of text (same length, one leading space) and the sorted boundary offsets in it"""
+    text = " " + text + "  "
+    text = text.replace("\n", " ")
+    # cheap substring checks skip the rules that cannot match
+    if "r." in text or "s." in text or "t." in text:
+        text = prefix_re.sub("\\1" + PRD, text)
+    if ".c" in text or ".n" in text or ".o" in text or ".i" in text or ".g" in text:
+        text = website_re.sub(PRD + "\\1", text)
+    if "Ph.D" in text: text = text.replace("Ph.D.", "Ph" + PRD + "D" + PRD)
+    text = initial_re.sub(" \\1" + PRD + " ", text)
+    stops = []
+    if dot_alpha.search(text):
+        stops = [m.end(1) for m in acr_stop_re.finditer(text)]
+        text = abc_re.sub("\\1" + PRD + "\\2" + PRD + "\\3" + PRD, text)
+        text = ab_re.sub("\\1" + PRD + "\\2" + PRD, text)
+    if "Inc" in text or "Ltd" in text or "Jr" in text or "Sr" in text or "Co" in text:
+        # the old rule dropped this dot and put the boundary after the suffix
+        found = [m.end(1) + 1 for m in suf_stop_re.finditer(text)]
+        if found:
+            stops += found
+            text = suf_stop_re.sub(" \\1" + DEL + " \\2", text)
+        text = suffix_re.sub(" \\1" + PRD, text)
+    text = letter_re.sub(" \\1" + PRD, text)
+    if "”" in text: text = text.replace(".”", "”.")
+    if "\"" in text: text = text.replace(".\"", "\".")
+    if "!" in text: text = text.replace("!\"", "\"!")
+    if "?" in text: text = text.replace("?\"", "\"?")
+    ends = [m.end() for m in end_re.finditer(text)]
+    return text, sorted(ends + stops) if stops else ends
+
+def sentence_spans(text):
+    """Yield (start, end) offsets of each sentence in text, surrounding whitespace excluded
+
+    text[start:end] holds the sentence's characters as written, so closing quotes stay after the
+    final punctuation; iter_sentences gives the strings exactly as the old splitter returned them."""
+    work, stops = mark(text)
+    n, a = len(text), 0
+    for b in stops:
+        s, e = a, b
+        while s < e and work[s].isspace(): s += 1
+        while e > s and work[e - 1].isspace(): e -= 1
+        yield min(max(s - 1, 0), n), min(max(e - 1, 0), n)
+        a = b
+
+def iter_sentences(text):
+    """Yield the sentences of text one at a time"""
+    work, stops = mark(text)
+    if DEL in work:
+        a = 0
+        for b in stops:
+            yield work[a:b].translate(restore).strip()
+            a = b
+    else:
+        work = work.replace(PRD, '.')
+        a = 0
+        for b in stops:
+            yield work[a:b].strip()
+            a = b
+
+def split_into_sentences(text):
+    return list(iter_sentences(text))
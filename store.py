@@ -0,0 +1,92 @@
+import os, sqlite3, hashlib, pathlib, numpy as np, pandas as pd
+
+
+# Persistent per-sentence sentiment results, so make_sentiment_plt only scores text it has not seen.
+# texts     one row per distinct (media, series_number, text_hash) source row, with how many times
+#           that text currently appears in the source
+# sentences polarity / subjectivity of the k-th sentence of each text
+# versions  the source tables' modified times per media when it was last brought up to date
+
+schema = """
+create table if not exists texts (media text, series_number integer, text_hash text, copies integer,
+                                  primary key (media, series_number, text_hash));
+create table if not exists sentences (media text, series_number integer, text_hash text, k integer,
+                                      polarity real, subjectivity real,
+                                      primary key (media, series_number, text_hash, k));
+create table if not exists versions (media text primary key, version text);
+"""
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class SentimentStore:
+    """SQLite table of scored sentences keyed by (media, series_number, text hash)"""
+
+    def __init__(self, path='~/.cache/harry/sentiment.sqlite'):
+        self.path = pathlib.Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con  = sqlite3.connect(self.path)
+        self.con.executescript(schema)
+
+    def version(self, media):
+        row = self.con.execute('select version from versions where media = ?', (media,)).fetchone()
+        return row[0] if row else None
+
+    def set_version(self, media, version):
+        with self.con:
+            self.con.execute('insert or replace into versions values (?, ?)', (media, version))
+
+    def known(self, media):
+        """Set of (series_number, text_hash) already scored for media"""
+        return set(self.con.execute('select series_number, text_hash from texts where media = ?', (media,)))
+
+    def add(self, media, keys, owner, polarity, subjectivity):
+        """Store newly scored texts; keys[j] is (series_number, text_hash) and owner[i] the text of sentence i"""
+        owner = np.asarray(owner, dtype=int)
+        k = np.arange(len(owner)) - np.searchsorted(owner, owner)   # position within its text
+        with self.con:
+            self.con.executemany('insert or ignore into texts values (?, ?, ?, 0)',
+                                 [(media, int(i), h) for i, h in keys])
+            self.con.executemany('insert or replace into sentences values (?, ?, ?, ?, ?, ?)',
+                                 [(media, int(keys[o][0]), keys[o][1], int(kk), float(p), float(s))
+                                  for o, kk, p, s in zip(owner, k, polarity, subjectivity)])
+
+    def set_copies(self, media, counts):
+        """Record how often each text appears now and forget texts that no longer appear"""
+        with self.con:
+            self.con.execute('update texts set copies = 0 where media = ?', (media,))
+            self.con.executemany('update texts set copies = ? where media = ? and series_number = ? and text_hash = ?',
+                                 [(c, media, int(i), h) for (i, h), c in counts.items()])
+            self.con.execute("""delete from sentences where media = ? and (series_number, text_hash) in
+                                (select series_number, text_hash from texts where media = ? and copies = 0)""",
+                             (media, media))
+            self.con.execute('delete from texts where media = ? and copies = 0', (media,))
+
+    def load(self, media=None, series_number=None):
+        """polarity, subjectivity, media, series_number for every stored sentence, as the hdf frame"""
+        where, args = [], []
+        if media is not None:
+            where.append('s.media = ?')
+            args.append(media)
+        if series_number is not None:
+            where.append('s.series_number = ?')
+            args.append(int(series_number))
+        q = f"""select s.polarity, s.subjectivity, s.media, s.series_number, t.copies
+                from sentences s join texts t using (media, series_number, text_hash)
+                {'where ' + ' and '.join(where) if where else ''}
+                order by s.media, s.series_number"""
+        df = pd.read_sql_query(q, self.con, params=args)
+        df = df.loc[df.index.repeat(df.pop('copies'))].reset_index(drop=True)
+        return df
+
+    def clear(self):
+        with self.con:
+            for t in ['texts', 'sentences', 'versions']:
+                self.con.execute(f'delete from {t}')
+
+
+def default_store():
+    """Store at HARRY_STORE, ~/.cache/harry/sentiment.sqlite by default"""
+    return SentimentStore(os.environ.get('HARRY_STORE', '~/.cache/harry/sentiment.sqlite'))
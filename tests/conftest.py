@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.fixture
+def datas():
+    """datas with its backend and cache put back after the test"""
+    import datas
+    backend, cache = datas.backend, datas.cache
+    yield datas
+    datas.set_backend(backend)
+    datas.set_cache(cache)
@@ -0,0 +1,186 @@
+import re, numpy as np
+from aliases import script_aliases
+from splitter import alphabets, prefixes, suffixes, starters, acronyms, websites
+
+
+# The code each rewrite replaced, and dense reference solutions for the model, kept as the parity
+# references the tests compare against and the baselines bench.py times.
+
+
+legacy_character_query = """ select * from(
+    select * from(
+        select *,
+            case 
+        when book = 'philosophers_stone' then 1
+        when book = 'chamber_of_secrets' then 2
+        when book = 'prisoner_of_azkaban' then 3
+        end as book_number
+            from (
+                select *
+                from `ambient-odyssey-331623.harry.characters` as A
+                join (
+                    select name as name_1, book, avg(mentions) as avg_mentions 
+                    from `ambient-odyssey-331623.harry.mentions` 
+                    group by name, book) as B
+                on '%' || B.name_1||'%' like '%' || A.name ||'%'
+    ))as A 
+
+    full join (SELECT character, movie_number, count(*) as script_counts
+    FROM `ambient-odyssey-331623.harry.script_v1` group by character, movie_number) as B 
+    on A.name  like '%' || B.character ||'%' and A.book_number = B.movie_number
+    ) as A
+    full join
+    `ambient-odyssey-331623.harry.screen_times_v1` as B
+    on '%' ||B.names||'%' like '%' || A.character ||'%' and A.movie_number = B.movie
+    Where Name is not Null order by Name
+
+    """
+
+def legacy_clean(df):
+    """The original per-cell clean_df loop, kept as the parity reference"""
+    X = (df.drop(columns = ["Id",'Wand',"Loyalty", "Skills", "Patronus","book", 'book_number', 'character', 'names', 'movie',
+                            'name_1','Death']))
+    for i in X.columns:
+        for j in range(X.shape[0]):
+            try: X[i].iloc[j] = X[i].iloc[j].replace('\xa0', ' ')
+            except: continue
+    X = X[~X['screen_time_sec'].isna()].reset_index(drop=True)
+    X.columns = X.columns.str.lower()
+    X['hair_colour'] = X['hair_colour'].replace('Silver| formerly auburn', 'Grey').replace('Blond', 'Blonde').replace('Colourless and balding', 'Bald')
+    X = X.fillna('unknown')
+    X['job_grouped'] = X['job']
+    X['blood_grouped'] = X['blood_status']
+    X['birth_yr'] = 0
+    X['eye_colour'] = X['eye_colour'].replace('Bright green', 'Green').replace('Bright brown', 'Brown').replace('Scarlet ', 'Scarlet')
+    odd_births = {'Vincent Crabbe'     : 1980,
+                  'Minerva McGonagall' : 1889,
+                  'Pomona Sprout'      : 1941,
+                  'Quirinus Quirrell'  : 1967,
+                  'Sir Nicholas'       : 1450,
+                 }
+    for i, df in X.iterrows():
+        if df['job'].find('Dark Arts') > -1:
+            X['job_grouped'].iloc[i] = 'defense against the dark arts professor'
+        elif df['job'].find('Student') > -1:
+            X['job_grouped'].iloc[i] = 'student'
+        else:
+            X['job_grouped'].iloc[i] = 'other'
+        if df['blood_status'].find('or') > -1:
+            X['blood_grouped'].iloc[i] = 'magic (unknown)'
+        for word in df['birth'].split():
+            if (word.isdigit()) and (int(word)>1880):
+                X['birth_yr'].iloc[i] = int(word)
+    for key,item in odd_births.items():
+        idx = X[X['name'] == key].index
+        X.loc[idx, 'birth_yr'] = item
+    X = X.drop(columns = ['job', 'blood_status', 'birth'])
+    return X
+
+def legacy_split_into_sentences(text):
+    """The original regex-pass splitter, kept as the parity reference"""
+    text = " " + text + "  "
+    text = text.replace("\n"," ")
+    text = re.sub(prefixes,"\\1<prd>",text)
+    text = re.sub(websites,"<prd>\\1",text)
+    if "Ph.D" in text: text = text.replace("Ph.D.","Ph<prd>D<prd>")
+    text = re.sub("\\s" + alphabets + "[.] "," \\1<prd> ",text)
+    text = re.sub(acronyms+" "+starters,"\\1<stop> \\2",text)
+    text = re.sub(alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]","\\1<prd>\\2<prd>\\3<prd>",text)
+    text = re.sub(alphabets + "[.]" + alphabets + "[.]","\\1<prd>\\2<prd>",text)
+    text = re.sub(" "+suffixes+"[.] "+starters," \\1<stop> \\2",text)
+    text = re.sub(" "+suffixes+"[.]"," \\1<prd>",text)
+    text = re.sub(" " + alphabets + "[.]"," \\1<prd>",text)
+    if "”" in text: text = text.replace(".”","”.")
+    if "\"" in text: text = text.replace(".\"","\".")
+    if "!" in text: text = text.replace("!\"","\"!")
+    if "?" in text: text = text.replace("?\"","\"?")
+    text = text.replace(".",".<stop>")
+    text = text.replace("?","?<stop>")
+    text = text.replace("!","!<stop>")
+    text = text.replace("<prd>",".")
+    sentences = text.split("<stop>")
+    sentences = sentences[:-1]
+    sentences = [s.strip() for s in sentences]
+    return sentences
+
+def legacy_sentiment_figure(hdf):
+    """The old make_sentiment_plt figure, every nonzero point shipped in a density_heatmap trace"""
+    import plotly.express as px, plotly.graph_objects as go
+    from sentiment import books
+    dfs = hdf.assign(series_nm=np.array(books)[hdf['series_number'] - 1])
+    dfs = list(dfs.query("polarity != 0 & subjectivity != 0").groupby(['series_nm', 'media']))
+    traces, buttons = [], []
+    for i, (name, d) in enumerate(dfs):
+        visible = [False] * len(dfs)
+        visible[i] = True
+        traces.append(px.density_heatmap(d, x='polarity', y='subjectivity', range_x=[-1, 1], range_y=[0, 1])
+                        .update_traces(visible=i == 0).data[0])
+        buttons.append(dict(label=f'{name}', method='update', args=[{'visible': visible}, {'title': f'{name}'}]))
+    fig = go.Figure(data=traces, layout=dict(updatemenus=[{'active': 0, 'buttons': buttons}]))
+    fig.update_layout(title=f'{dfs[0][0]}', title_x=0.5, width=900, height=700,
+                      xaxis_title='polarity', yaxis_title='subjectivity')
+    return fig
+
+def legacy_clean_movie_characters(df):
+    """The old per-row character loop of make_sentiment_plt, kept as the parity reference"""
+    df = df.reset_index(drop=True)
+    for i in range(df.shape[0]):
+        df['character'].iloc[i] = df['character'].iloc[i].replace('\n', '')
+        df['character'].iloc[i] = df['character'].iloc[i].replace('  ', ' ')
+        if df['character'].iloc[i][-1] == ' ':
+            df['character'].iloc[i] = df['character'].iloc[i][:-1]
+        df['character'].iloc[i] = df['character'].iloc[i].replace('\xa0', ' ')
+    for i in range(df.shape[0]):
+        try:
+            df['character'].iloc[i] = script_aliases[df['character'].iloc[i]]
+        except:
+            continue
+    return df
+
+def legacy_comb_chapters(X):
+    """The old iterrows loop with the 17 and 17 + 19 chapter offsets written in"""
+    X['comb_chapters'] = X['chapter']
+    for i,data in X.iterrows():
+        if data['movie_number'] == 1:
+            X['comb_chapters'].iloc[i] = data['chapter']
+        if data['movie_number'] == 2:
+            X['comb_chapters'].iloc[i] = data['chapter'] + 17
+        if data['movie_number'] == 3:
+            X['comb_chapters'].iloc[i] = data['chapter'] + 17 + 19
+    X['comb_chapters'] = X['comb_chapters'].astype('int')
+    return X
+
+def legacy_mentions_figure(X, offsets):
+    """The old px.scatter animation over every row"""
+    import plotly.express as px
+    X = X.assign(comb_chapters=X['chapter'] + offsets[X['movie_number'].to_numpy() - 1]).sort_values(['name', 'house', 'comb_chapters'])
+    return px.scatter(X, x='script_counts', y='mentions', size='screen_time_sec', color='house',
+                      color_discrete_sequence=['red', 'gold', 'blue', 'green', 'black'],
+                      category_orders={'house': ['Gryffindor', 'Hufflepuff', 'Ravenclaw', 'Slytherin', 'unknown']},
+                      animation_frame='comb_chapters', hover_name='name', range_x=[-10, 400], range_y=[-10, 100])
+
+def dense_design(enc, D):
+    """Intercept, one-hot and numeric columns of a model Design as one dense array"""
+    onehot = np.zeros((len(D.codes), enc.n_one_hot + 1))
+    np.put_along_axis(onehot, D.codes, 1, axis=1)
+    return np.hstack([np.ones((len(D.codes), 1)), onehot[:, :-1], D.numeric])
+
+def dense_cv(A, y, f, alphas):
+    """Mean held out rmse per alpha, refitting the dense centered system for every fold and alpha"""
+    rmse = []
+    for a in alphas:
+        errs = []
+        for i in np.unique(f):
+            tr, te = f != i, f == i
+            mean = A[tr, 1:].mean(0)
+            Ac, yc = A[tr, 1:] - mean, y[tr] - y[tr].mean()
+            b = np.linalg.lstsq(Ac.T @ Ac + a * np.eye(Ac.shape[1]), Ac.T @ yc, rcond=None)[0]
+            errs.append(np.sqrt(((A[te, 1:] @ b + y[tr].mean() - mean @ b - y[te]) ** 2).mean()))
+        rmse.append(np.mean(errs))
+    return np.array(rmse)
+
+def legacy_load(backend, tbl, df):
+    """load_table before chunking on a LocalBackend: drop, then write the whole frame in one go"""
+    backend.drop(tbl)
+    df.to_parquet(backend.file(tbl), index=False)
+    backend.refresh()
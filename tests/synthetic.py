@@ -0,0 +1,158 @@
+import numpy as np, pandas as pd
+from aliases import script_aliases
+
+
+# Synthetic stand-ins for the BigQuery tables and the frames the pipeline passes around, used by the
+# tests and timed by bench.py. Every generator is seeded, so a size always gives the same frame.
+
+
+houses = ['Gryffindor', 'Hufflepuff', 'Ravenclaw', 'Slytherin', None]
+jobs   = ['Student', 'Professor of Defence Against the Dark Arts', 'Auror', 'Student\xa0(formerly)', 'Minister for Magic', None]
+bloods = ['Pure-blood', 'Half-blood', 'Muggle-born', 'Pure-blood or half-blood', None]
+hairs  = ['Black', 'Blond', 'Silver| formerly auburn', 'Colourless and balding', 'Red', None]
+eyes   = ['Bright green', 'Bright brown', 'Scarlet ', 'Blue', None]
+births = ['31 July 1980', 'Between 1 September 1979\xa0and 31 August 1980', '4 October 1935', 'Late 1880s', '1450 or earlier', None]
+names  = ['Harry Potter', 'Vincent Crabbe', 'Minerva McGonagall', 'Pomona Sprout', 'Quirinus Quirrell', 'Sir Nicholas', 'Oliver\xa0Wood']
+
+
+def make_join(n, seed=42):
+    """Synthetic stand-in for the characters / mentions / script / screen time join with n rows"""
+    rng = np.random.default_rng(seed)
+    pick = lambda ls: np.array(ls, dtype=object)[rng.integers(0, len(ls), n)]
+    screen = rng.integers(0, 2000, n).astype(float)
+    screen[rng.random(n) < 0.2] = np.nan
+    return pd.DataFrame({'Id'             : np.arange(n),
+                         'Name'           : pick(names),
+                         'Gender'         : pick(['Male', 'Female']),
+                         'Job'            : pick(jobs),
+                         'House'          : pick(houses),
+                         'Wand'           : pick(['11" Holly phoenix feather', None]),
+                         'Patronus'       : pick(['Stag', None]),
+                         'Species'        : pick(['Human', 'Ghost']),
+                         'Blood_status'   : pick(bloods),
+                         'Hair_colour'    : pick(hairs),
+                         'Eye_colour'     : pick(eyes),
+                         'Loyalty'        : pick(['Albus Dumbledore', None]),
+                         'Skills'         : pick(['Quidditch', None]),
+                         'Birth'          : pick(births),
+                         'Death'          : pick([None, '2 May 1998']),
+                         'name_1'         : pick(names),
+                         'book'           : pick(['philosophers_stone', 'chamber_of_secrets', 'prisoner_of_azkaban']),
+                         'avg_mentions'   : rng.random(n) * 100,
+                         'book_number'    : rng.integers(1, 4, n),
+                         'character'      : pick(['Harry', 'Ron', None]),
+                         'movie_number'   : rng.integers(1, 4, n),
+                         'script_counts'  : rng.integers(0, 400, n),
+                         'names'          : pick(['Harry Potter', None]),
+                         'screen_time_sec': screen,
+                         'movie'          : rng.integers(1, 4, n),
+                        })
+
+def make_tables(chars=200, script_lines=50_000, seed=0):
+    """Synthetic characters, mentions, mentions_chapters, script_v1 and screen_times_v1 tables"""
+    rng   = np.random.default_rng(seed)
+    first = np.array([f'First{i:05d}' for i in range(chars)] + ['Oliver', 'Tom', 'Gilderoy'])
+    last  = np.array([f'Last{i:05d}' for i in range(chars)] + ['Wood', 'Riddle', 'Lockhart'])
+    full  = np.char.add(np.char.add(first, ' '), last)
+    n     = len(full)
+    books = ['philosophers_stone', 'chamber_of_secrets', 'prisoner_of_azkaban']
+    characters = make_join(n, seed)[['Id', 'Name', 'Gender', 'Job', 'House', 'Wand', 'Patronus', 'Species', 'Blood_status',
+                                     'Hair_colour', 'Eye_colour', 'Loyalty', 'Skills', 'Birth', 'Death']]
+    characters['Name'] = full
+    chapters = pd.DataFrame([(f, b, c) for f in full for b, nc in zip(books, (17, 19, 22)) for c in range(1, nc + 1)],
+                            columns=['name', 'book', 'chapter'])
+    chapters['mentions'] = rng.integers(0, 50, len(chapters))
+    mentions = chapters.groupby(['name', 'book'], as_index=False)['mentions'].sum()
+    spoken = np.concatenate([first, last, list(script_aliases)])
+    script = pd.DataFrame({'character'   : spoken[rng.integers(0, len(spoken), script_lines)],
+                           'movie_number': rng.integers(1, 4, script_lines),
+                           'sentence'    : 'Hello there.'})
+    screen = pd.DataFrame({'names'          : np.repeat(full, 3),
+                           'screen_time_sec': rng.integers(0, 3000, 3 * n).astype(float),
+                           'movie'          : np.tile([1, 2, 3], n)})
+    return {'characters': characters, 'mentions': mentions, 'mentions_chapters': chapters,
+            'script_v1': script, 'screen_times_v1': screen}
+
+def local_backend(tables, path):
+    """LocalBackend over Parquet files of tables written to path"""
+    from backends import LocalBackend
+    b = LocalBackend(path)
+    for name, df in tables.items():
+        b.load_dataframe(name, df)
+    return b
+
+def make_sentences(n, seed=0):
+    """n sentences drawn from a small vocabulary with the usual sentiment words"""
+    rng   = np.random.default_rng(seed)
+    words = np.array('harry ron hermione said the wand was very good bad dark terrible happy quite '
+                     'angry brilliant castle slowly great awful wonderful sad strange'.split())
+    lens  = rng.integers(4, 20, n)
+    return [' '.join(words[rng.integers(0, len(words), k)]) + '.' for k in lens]
+
+def make_paragraphs(n, seed=0):
+    """n book-like paragraphs, with titles, initials, acronyms and quotes mixed into plain sentences"""
+    rng    = np.random.default_rng(seed)
+    sents  = make_sentences(8 * n, seed)
+    extras = ['Mr. Dursley said "Hello."', 'Ph.D. students at www.hogwarts.com were fine!', 'It was the U.S.A. He asked?',
+              'Professor A. Dumbledore smiled.', 'Ron Weasley Jr. He laughed.', '\u201cWho?\u201d asked Harry.\nThen he left.']
+    sents  = [s if rng.random() > 0.15 else extras[rng.integers(len(extras))] for s in sents]
+    return [' '.join(sents[k:k + 8]) for k in range(0, len(sents), 8)]
+
+def make_corpus(paragraphs=2000, lines=2000, seed=0):
+    """Synthetic book_* (chapter, script) and movie_* (character, sentence) tables"""
+    books = ['philosophers_stone', 'chamber_of_secrets', 'prisoner_of_azkaban', 'goblet_of_fire',
+             'order_of_the_phoenix', 'half_blood_prince', 'deathly_hallows']
+    rng    = np.random.default_rng(seed)
+    spoken = np.array(['harry ', 'ron\n', 'Hermione\xa0', 'Oiiver', 'wood', 'professor  snape'])
+    tables = {}
+    for k, b in enumerate(books):
+        tables[f'book_{b}'] = pd.DataFrame({'chapter': np.sort(rng.integers(1, 30, paragraphs)),
+                                            'script' : make_paragraphs(paragraphs, seed + k)})
+        if k < 3:
+            tables[f'movie_{b}'] = pd.DataFrame({'character': spoken[rng.integers(0, len(spoken), lines)],
+                                                 'sentence' : make_sentences(lines, seed + k)})
+    return tables
+
+def make_scores(n, seed=0):
+    """n scored sentences spread over the seven books and three movies, as sentiment_frame returns"""
+    rng   = np.random.default_rng(seed)
+    media = np.where(rng.random(n) < 0.7, 'book', 'movie')
+    series = np.where(media == 'book', rng.integers(1, 8, n), rng.integers(1, 4, n))
+    pol   = np.clip(rng.normal(0.05, 0.3, n), -1, 1)
+    sub   = np.clip(rng.normal(0.45, 0.25, n), 0, 1)
+    pol[rng.random(n) < 0.3] = 0
+    return pd.DataFrame({'polarity': pol, 'subjectivity': sub, 'media': media, 'series_number': series})
+
+def make_script(lines=30_000, seed=0):
+    """Movie script lines as movie_query returns them, names capitalised the way the sql does it"""
+    rng    = np.random.default_rng(seed)
+    spoken = np.array(['harry ', 'ron\n', 'hermione\xa0', 'oiiver', 'wood', 'professor  snape', 'all', 'ron and harry',
+                       'vernon  ', 'stan shunpike', 'mrs. weasley', 'dumbledore '])
+    names  = pd.Series(spoken[rng.integers(0, len(spoken), lines)])
+    return pd.DataFrame({'character'   : names.str[:1].str.upper() + names.str[1:],
+                         'sentence'    : 'Hello there.',
+                         'movie_number': rng.integers(1, 4, lines)})
+
+def make_mentions_frame(chars=200, chapters=(17, 18, 22, 37, 38, 30, 37), seed=0):
+    """Compacted mentions_animation frame for chars characters over books with the given chapter counts"""
+    from cleaning import compact
+    rng    = np.random.default_rng(seed)
+    houses = np.array(['Gryffindor', 'Hufflepuff', 'Ravenclaw', 'Slytherin', 'unknown'])[rng.integers(0, 5, chars)]
+    rows   = [(f'Name{c:05d}', houses[c], b + 1, ch) for c in range(chars) for b, nc in enumerate(chapters)
+              for ch in range(1, nc + 1) if rng.random() < 0.6]
+    X = pd.DataFrame(rows, columns=['name', 'house', 'movie_number', 'chapter'])
+    per_book = rng.integers(0, 400, (chars, len(chapters))), rng.integers(0, 3000, (chars, len(chapters)))
+    c = X['name'].str[4:].astype(int).to_numpy()
+    X['script_counts']   = per_book[0][c, X['movie_number'] - 1]
+    X['screen_time_sec'] = per_book[1][c, X['movie_number'] - 1].astype(float)
+    X['mentions']        = rng.integers(0, 100, len(X))
+    return compact(X), np.concatenate([[0], np.cumsum(chapters)[:-1]])
+
+def make_scored(n, seed=0):
+    """Synthetic scored sentences table: sentence text with polarity, subjectivity, media and series number"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'sentence'     : np.array(make_sentences(1000, seed), dtype=object)[rng.integers(0, 1000, n)],
+                         'polarity'     : rng.uniform(-1, 1, n),
+                         'subjectivity' : rng.uniform(0, 1, n),
+                         'media'        : np.where(rng.random(n) < 0.7, 'book', 'movie').astype(object),
+                         'series_number': rng.integers(1, 8, n)})
@@ -0,0 +1,60 @@
+import tempfile, pandas as pd
+from aliases import alias_table, script_aliases
+from tests.synthetic import make_tables, local_backend
+from tests.legacy import legacy_character_query
+
+
+characters = pd.DataFrame({'Id': [1, 2, 3, 4, 5], 'Name': ['Harry Potter', 'Oliver Wood', 'Ron Weasley', None, '']})
+mentions   = ['Harry Potter', 'Mr Harry Potter', 'Ron Weasley', 'harry potter', 'Harry Potter', None, '']
+script     = ['Harry', 'Potter', 'Ron', 'Wood', 'Oiiver', 'oiiver', 'harry', 'Hagrid', None, '']
+screen     = ['Harry Potter (young)', 'Oliver Wood', 'Oiiver (credits)', 'Hagrid', None, '']
+
+def resolved(df, source):
+    return set(df.loc[df['source'] == source, ['alias', 'char_id']].itertuples(index=False, name=None))
+
+def test_mentions_contain_the_character_name():
+    df = alias_table(characters, mentions, script, screen)
+    assert resolved(df, 'mentions') == {('Harry Potter', 1), ('Mr Harry Potter', 1), ('Ron Weasley', 3)}
+
+def test_script_names_in_the_character_name_or_through_extra():
+    """Substrings match in their own case only; an entry of extra matches its character ignoring case,
+    but only when the script spells the key exactly"""
+    df = alias_table(characters, mentions, script, screen)
+    assert resolved(df, 'script') == {('Harry', 1), ('Potter', 1), ('Ron', 3), ('Wood', 2), ('Oiiver', 2)}
+    no_extra = alias_table(characters, mentions, script, screen, extra={})
+    assert resolved(no_extra, 'script') == {('Harry', 1), ('Potter', 1), ('Ron', 3), ('Wood', 2)}
+
+def test_screen_names_go_through_script_names():
+    """A screen name resolves to the characters of the script names it contains, Hagrid has none"""
+    df = alias_table(characters, mentions, script, screen)
+    assert resolved(df, 'screen') == {('Harry Potter (young)', 1), ('Oliver Wood', 2), ('Oiiver (credits)', 2)}
+
+def test_missing_and_empty_names_resolve_nothing():
+    df = alias_table(characters, mentions, script, screen)
+    assert not df['char_id'].isin([4, 5]).any()
+    assert not df['alias'].isna().any() and not (df['alias'] == '').any()
+    assert len(df) == len(df.drop_duplicates())
+
+def test_character_query_matches_the_like_joins(datas, chars=50):
+    """Grouped by character and book, character_query gives the mentions, screen time and script lines
+    the LIKE joins gave, plus the lines of script names only extra resolves"""
+    tables = make_tables(chars=chars, script_lines=10_000)
+    with tempfile.TemporaryDirectory() as d:
+        datas.set_backend(local_backend(tables, d))
+        datas.build_name_alias()
+        old = datas.run_query(legacy_character_query, use_cache=False)
+        new = datas.run_query(datas.character_query(), use_cache=False)
+    group = lambda df: (df.groupby(['Name', 'book_number'], dropna=False)
+                          .agg(avg_mentions=('avg_mentions', 'first'), screen_time_sec=('screen_time_sec', 'first'),
+                               script_counts=('script_counts', 'sum')))
+    old, new = group(old), group(new)
+    # script lines of an extra key that is not itself part of the name, which LIKE could not match
+    s = tables['script_v1']
+    extra_only = [(name, key) for name in old.index.levels[0] for key, target in script_aliases.items()
+                  if key not in name and target.lower() in name.lower()]
+    for name, key in extra_only:
+        lines = s[s['character'] == key]['movie_number'].value_counts()
+        for book, k in lines.items():
+            old.loc[(name, book), 'script_counts'] += k
+    assert extra_only
+    pd.testing.assert_frame_equal(new, old, check_dtype=False, check_index_type=False)
@@ -0,0 +1,33 @@
+import json, base64, numpy as np
+from tests.synthetic import make_mentions_frame
+
+
+def test_animation_frames(chars=100, jumps=300):
+    """Replay animation_figure's partial frames the way plotly merges them, playing through and jumping
+    along the slider, and compare the points on screen with the rows of each chapter"""
+    import plotly.io as pio
+    from animation import animation_figure
+    X, offsets = make_mentions_frame(chars)
+    fig = json.loads(pio.to_json(animation_figure(X, offsets)))
+    dec = lambda v: np.frombuffer(base64.b64decode(v['bdata']), dtype=v['dtype']).astype(float) if isinstance(v, dict) else np.asarray(v, float)
+    comb = X['chapter'] + offsets[X['movie_number'].to_numpy() - 1]
+    want = {str(k): {(str(h), str(n), float(x), float(y), float(z)) for h, n, x, y, z in
+                     zip(g['house'], g['name'], g['script_counts'], g['mentions'], g['screen_time_sec'])}
+            for k, g in X.groupby(comb, observed=True)}
+    traces = [{'name': d['name'], 'text': d['hovertext'], 'x': dec(d['x']), 'y': dec(d['y']), 'size': dec(d['marker']['size'])}
+              for d in fig['data']]
+    frames = {f['name']: f for f in fig['frames']}
+    def show(name):
+        for t, u in zip(frames[name]['traces'], frames[name]['data']):
+            traces[t].update({k: dec(v) for k, v in [('x', u.get('x')), ('y', u.get('y'))] if v is not None})
+            if 'marker' in u:
+                traces[t]['size'] = dec(u['marker']['size'])
+        return {(d['name'], n, x, y, z) for d in traces for n, x, y, z in zip(d['text'], d['x'], d['y'], d['size'])
+                if not np.isnan(y)}
+    for name in frames:
+        assert show(name) == want[name], name
+    steps = fig['layout']['sliders'][0]['steps']
+    for k in np.random.default_rng(0).integers(0, len(steps), jumps):
+        for name in steps[k]['args'][0]:
+            on_screen = show(name)
+        assert on_screen == want[steps[k]['label']], steps[k]['label']
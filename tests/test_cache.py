@@ -0,0 +1,57 @@
+import os, pathlib, pandas as pd
+from cache import QueryCache
+
+
+query = 'select * from `p.harry.characters` join p.harry.mentions using (name)'
+
+class Source:
+    """Stand-in backend: counts the queries it runs and the modified time of every table"""
+
+    def __init__(self, frame):
+        self.frame    = frame
+        self.runs     = 0
+        self.modified = {'p.harry.characters': 1, 'p.harry.mentions': 1}
+
+    def run(self, query):
+        self.runs += 1
+        return self.frame
+
+
+def test_hit_miss_and_invalidation(tmp_path):
+    src, cache = Source(pd.DataFrame({'name': ['Harry', 'Ron'], 'n': [1, 2]})), QueryCache(tmp_path)
+    pd.testing.assert_frame_equal(cache.fetch(query, src.run, src.modified.get), src.frame)
+    assert (src.runs, cache.hits, cache.misses) == (1, 0, 1)
+    # whitespace, comments and a trailing semicolon are not part of the key
+    same = '  select *\n  from `p.harry.characters` -- every character\n join p.harry.mentions   using (name);'
+    pd.testing.assert_frame_equal(cache.fetch(same, src.run, src.modified.get), src.frame)
+    assert (src.runs, cache.hits) == (1, 1)
+    src.modified['p.harry.mentions'] = 2
+    cache.fetch(query, src.run, src.modified.get)
+    assert (src.runs, cache.misses) == (2, 2)
+
+def test_statements_bypass_the_cache(tmp_path):
+    src, cache = Source(None), QueryCache(tmp_path)
+    for _ in range(2):
+        cache.fetch('drop table `p.harry.characters`', src.run, src.modified.get)
+    assert src.runs == 2 and cache.hits == cache.misses == 0
+    assert not list(tmp_path.glob('*.parquet'))
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = QueryCache(tmp_path)
+    for k in range(4):
+        cache.put(f'k{k}', pd.DataFrame({'n': range(100)}))
+        os.utime(cache.file(f'k{k}'), (1000 + k, 1000 + k))
+    cache.get('k0')       # now the most recently used
+    cache.max_bytes = cache.size() // 2
+    cache.evict()
+    assert sorted(f.stem for f in tmp_path.glob('*.parquet')) == ['k0', 'k3']
+
+def test_files_evicted_by_another_process_are_skipped(tmp_path, monkeypatch):
+    cache = QueryCache(tmp_path)
+    cache.put('k0', pd.DataFrame({'n': range(100)}))
+    glob = pathlib.Path.glob
+    monkeypatch.setattr(pathlib.Path, 'glob', lambda self, p: [*glob(self, p), self / 'gone.parquet'])
+    assert cache.size() == cache.file('k0').stat().st_size
+    cache.max_bytes = 0
+    cache.evict()
+    assert not cache.has('k0')
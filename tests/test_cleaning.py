@@ -0,0 +1,10 @@
+import pandas as pd
+from cleaning import character_pipeline
+from tests.synthetic import make_join
+from tests.legacy import legacy_clean
+
+
+def test_clean_parity(n=2000):
+    """character_pipeline must give exactly the frame the original loops gave"""
+    df = make_join(n)
+    pd.testing.assert_frame_equal(character_pipeline(df.copy()), legacy_clean(df.copy()))
@@ -0,0 +1,30 @@
+import tempfile, pandas as pd, pytest
+import sentiment, corpus
+from cache import QueryCache
+from splitter import split_into_sentences
+from tests.synthetic import make_corpus, local_backend
+
+
+def test_corpus_parity(datas, paragraphs=300):
+    """Scores read from the memory-mapped corpus must equal sentiment_frame's, its texts the tables' strings"""
+    tables = make_corpus(paragraphs, paragraphs)
+    with tempfile.TemporaryDirectory() as d:
+        datas.set_backend(local_backend(tables, d))
+        datas.set_cache(QueryCache(f'{d}/cache'))
+        c = corpus.build_corpus(corpus.Corpus(f'{d}/corpus'))
+        paras = c.paragraphs('book_1')
+        texts = [paras[i] for i in range(len(paras))]
+        assert texts == tables['book_philosophers_stone']['script'].tolist()
+        assert sum(c.sentences('book_1').batches(7), []) == [s for t in texts for s in split_into_sentences(t)]
+        pd.testing.assert_frame_equal(sentiment.sentiment_frame(workers=1, corpus=c), sentiment.sentiment_frame(workers=1))
+
+def test_default_corpus(datas, monkeypatch, paragraphs=50):
+    """corpus=True scores the corpus at HARRY_CORPUS, and make_sentiment_plt only takes it without the store"""
+    with tempfile.TemporaryDirectory() as d:
+        datas.set_backend(local_backend(make_corpus(paragraphs, paragraphs), d))
+        datas.set_cache(QueryCache(f'{d}/cache'))
+        monkeypatch.setenv('HARRY_CORPUS', f'{d}/corpus')
+        pd.testing.assert_frame_equal(sentiment.sentiment_frame(workers=1, corpus=True), sentiment.sentiment_frame(workers=1))
+        assert corpus.default_corpus().units
+    with pytest.raises(ValueError):
+        sentiment.make_sentiment_plt(corpus=True)
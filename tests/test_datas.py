@@ -0,0 +1,40 @@
+import tempfile, threading, pandas as pd, pytest
+from backends import LocalBackend
+from tests.synthetic import make_scored
+
+
+def test_load_table(datas, n=200_000, rows=30_000):
+    """Chunked loads of a frame and of a generator must give the frame back, append must add to it,
+    an error part way must leave the table alone, readers during a load must only ever see the
+    old or the new table, and a column all null in the first chunk must take its type from later ones"""
+    df = make_scored(n)
+    read = lambda: datas.backend.query('select * from "scored"')
+    with tempfile.TemporaryDirectory() as d:
+        datas.set_backend(LocalBackend(d))
+        datas.load_frames('db.scored', df, rows=rows)
+        pd.testing.assert_frame_equal(read(), df)
+        datas.load_table('db.scored', df=(df.iloc[i:i + rows // 3] for i in range(0, n, rows // 3)), overwrite=False)
+        pd.testing.assert_frame_equal(read(), pd.concat([df, df], ignore_index=True))
+        def failing():
+            yield df
+            raise RuntimeError('source failed')
+        with pytest.raises(RuntimeError):
+            datas.load_table('db.scored', df=failing())
+        assert len(read()) == 2 * n
+        seen, done = set(), threading.Event()
+        def reader():
+            while not done.is_set():
+                seen.add(datas.backend.query('select count(*) as n from "scored"')['n'][0])
+        t = threading.Thread(target=reader)
+        t.start()
+        for k in range(3):
+            datas.load_frames('db.scored', df.iloc[:n // (k + 2)], rows=rows)
+        done.set()
+        t.join()
+        assert seen <= {2 * n, n // 2, n // 3, n // 4}, seen
+        # a column all null in the first chunk, of a frame and of a generator starting with an empty frame
+        nulls = pd.DataFrame({'a': [1, 2, 3], 'b': [None, None, 'x']})
+        datas.load_frames('db.nulls', nulls, rows=2)
+        pd.testing.assert_frame_equal(datas.backend.query('select * from "nulls"'), nulls)
+        datas.load_frames('db.nulls', (df for df in [nulls.iloc[:0], nulls.iloc[:2], nulls.iloc[2:]]), rows=2)
+        pd.testing.assert_frame_equal(datas.backend.query('select * from "nulls"'), nulls)
@@ -0,0 +1,27 @@
+import os, sys, pathlib, subprocess, pytest
+
+
+# ms a module may take to import on top of numpy and pandas, and modules it must not pull in
+import_budget_ms = {'cleaning': 50, 'datas': 150, 'sentiment': 200}
+heavy_imports    = ['google', 'plotly', 'textblob', 'duckdb']
+
+def import_time(module):
+    """(cumulative ms to import module once numpy / pandas are loaded, [(ms, name)] of its slowest imports,
+    heavy modules it loaded), from python -X importtime in a fresh process without HARRY_LOCAL_DIR"""
+    env = {k: v for k, v in os.environ.items() if k != 'HARRY_LOCAL_DIR'}
+    code = (f'import numpy, pandas, sys; import {module}; '
+            f'print(" ".join(m for m in {heavy_imports!r} if m in sys.modules))')
+    res  = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, capture_output=True, text=True,
+                          check=True, cwd=pathlib.Path(__file__).resolve().parent.parent)
+    rows = [line.split('|') for line in res.stderr.splitlines() if line.startswith('import time:')][1:]
+    rows = [(int(cum) / 1000, name.rstrip()) for _, cum, name in rows]
+    rows = rows[[name for _, name in rows].index(' pandas') + 1:]
+    return rows[-1][0], sorted(rows, reverse=True)[1:6], res.stdout.split()
+
+@pytest.mark.parametrize('module', import_budget_ms)
+def test_import_budget(module):
+    """A module must import within its budget and without loading google / plotly / textblob / duckdb"""
+    total, slowest, heavy = import_time(module)
+    assert not heavy, f'importing {module} loads {heavy}'
+    assert total <= import_budget_ms[module], (f'importing {module} takes {total:.0f} ms, budget {import_budget_ms[module]} ms, '
+                                               'slowest: ' + ', '.join(f'{n.strip()} {ms:.0f}' for ms, n in slowest[:3]))
@@ -0,0 +1,22 @@
+import numpy as np
+import model
+from cleaning import character_pipeline
+from tests.synthetic import make_join
+from tests.legacy import dense_design, dense_cv
+
+
+def test_model_parity(n=5000, alphas=(0, 0.5, 10), k=5):
+    """Least squares predictions must match np.linalg.lstsq on the dense design, ridge coefficients
+    the dense closed form and cross-validation a refit per fold"""
+    X = character_pipeline(make_join(n))
+    X = X[X[model.target].notna()]
+    enc = model.Encoder().fit(X)
+    A, y = dense_design(enc, enc.transform(X)), X[model.target].to_numpy(dtype=float)
+    beta = np.linalg.lstsq(A, y, rcond=None)[0]
+    assert np.allclose(model.Regression(0).fit(X).predict(X, batch_size=n // 7), A @ beta)
+    Ac = A[:, 1:] - A[:, 1:].mean(0)
+    for a in alphas[1:]:
+        b = np.linalg.solve(Ac.T @ Ac + a * np.eye(Ac.shape[1]), Ac.T @ (y - y.mean()))
+        assert np.allclose(model.Regression(a).fit(X).coef, b)
+    cv = model.cross_validate(X, alphas, k)
+    assert np.allclose(cv['rmse'], dense_cv(A, y, model.folds(len(y), k), alphas))
@@ -0,0 +1,12 @@
+import numpy as np
+from tests.synthetic import make_sentences
+
+
+def test_score_parity(n=2000):
+    """scoring.score must agree with TextBlob(s).polarity / .subjectivity"""
+    from textblob import TextBlob
+    from scoring import score
+    sents = make_sentences(n)
+    pol, subj = score(sents, workers=1)
+    assert np.array_equal(pol, [TextBlob(s).polarity for s in sents])
+    assert np.array_equal(subj, [TextBlob(s).subjectivity for s in sents])
@@ -0,0 +1,24 @@
+import numpy as np, pandas as pd
+from tests.synthetic import make_scores, make_script
+from tests.legacy import legacy_clean_movie_characters
+
+
+def test_bins_parity(n=100_000, bins=(40, 20)):
+    """sentiment_bins counts against one np.histogram2d per group"""
+    from sentiment import sentiment_bins, books
+    hdf = make_scores(n)
+    groups, x, y, counts = sentiment_bins(hdf, bins)
+    nz = hdf.query('polarity != 0 & subjectivity != 0')
+    names = np.array(books)[nz['series_number'] - 1]
+    for g, (name, media) in enumerate(groups):
+        d = nz[(names == name) & (nz['media'] == media).to_numpy()]
+        ref, _, _ = np.histogram2d(d['subjectivity'], d['polarity'], bins=[y, x])
+        assert (ref == counts[g]).all(), (name, media)
+
+def test_movie_characters_parity(lines=5_000):
+    """clean_movie_characters must name every line as the old row loop did, as a categorical"""
+    from sentiment import clean_movie_characters
+    df = make_script(lines)
+    ref, new = legacy_clean_movie_characters(df.copy()), clean_movie_characters(df)
+    assert isinstance(new['character'].dtype, pd.CategoricalDtype)
+    assert (ref['character'] == new['character'].astype(object)).all()
@@ -0,0 +1,49 @@
+import json, tempfile, threading, urllib.request, pytest
+import server, sentiment, animation
+from cache import QueryCache
+from tests.synthetic import make_tables, make_corpus, local_backend
+
+
+@pytest.mark.parametrize('header, gzip', [('gzip', True), ('deflate, gzip, br', True), ('GZIP;Q=0.5', True),
+                                          ('br, *;q=0.1', True), ('x-gzip', True), ('', False), ('identity', False),
+                                          ('gzip;q=0', False), ('deflate, gzip;q=0.0', False), ('*;q=0', False),
+                                          ('gzip;q=0, *', False)])
+def test_accepts_gzip(header, gzip):
+    assert server.accepts_gzip(header) == gzip
+
+def test_gzip_refused_with_q0():
+    app = server.App()
+    app.resources = {'/sentiment/bins': server.resource(b'{"counts": []}' * 10)}
+    httpd = server.make_server(app, port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        url = f'http://127.0.0.1:{httpd.server_address[1]}/sentiment/bins'
+        for header, encoding in [('gzip', 'gzip'), ('gzip;q=0', None)]:
+            with urllib.request.urlopen(urllib.request.Request(url, headers={'Accept-Encoding': header})) as r:
+                assert r.headers.get('Content-Encoding') == encoding
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+def test_resources_are_built_from_one_aggregation(datas, monkeypatch):
+    """Each group bins / lays out its data once and derives the figure and the data resource from it"""
+    calls = {'bins': 0, 'animation': 0}
+    def counted(name, f):
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return f(*args, **kwargs)
+        return wrapper
+    monkeypatch.setattr(sentiment, 'sentiment_bins', counted('bins', sentiment.sentiment_bins))
+    data = counted('animation', animation.animation_data)
+    monkeypatch.setattr(animation, 'animation_data', data)
+    monkeypatch.setattr(server, 'animation_data', data)
+    with tempfile.TemporaryDirectory() as d:
+        datas.set_backend(local_backend({**make_tables(chars=20, script_lines=2000), **make_corpus(50, 50)}, d))
+        datas.set_cache(QueryCache(f'{d}/cache'))
+        datas.build_name_alias()
+        app = server.App(workers=1, store=f'{d}/sentiment.sqlite')
+        assert app.refresh() == ['sentiment', 'mentions']
+        app.store.con.close()
+    assert calls == {'bins': 1, 'animation': 1}
+    counts = json.loads(app.resources['/sentiment/bins'].body)['counts']
+    assert sum(map(len, counts)) and json.loads(app.resources['/mentions/data'].body)['points']['name']
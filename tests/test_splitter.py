@@ -0,0 +1,9 @@
+from splitter import split_into_sentences
+from tests.synthetic import make_paragraphs
+from tests.legacy import legacy_split_into_sentences
+
+
+def test_split_parity(n=20_000):
+    """splitter.split_into_sentences must match the old splitter"""
+    for p in make_paragraphs(n):
+        assert split_into_sentences(p) == legacy_split_into_sentences(p), p